@@ -1,5 +1,5 @@
 #!/bin/bash
 
 mkdir -p ~/.local/share/gedit/plugins/
-cp multicursor.* ~/.local/share/gedit/plugins/
+cp multicursor.plugin multicursor*.py ~/.local/share/gedit/plugins/
 
@@ -1,20 +1,53 @@
-from gi.repository import GObject, Gtk, Gdk, Gedit, Pango
+from gi.repository import GObject, GLib, Gio, Gtk, GtkSource, Gdk, Gedit, Pango
 
 import re
-from collections import OrderedDict
+from bisect import bisect_left
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+
+from multicursor_casing import Casing
+from multicursor_diff import OffsetMap
+from multicursor_index import OffsetIndex
+
+# the plugin switches to large file mode when the document or the number of 
+#  cursors goes above any of these sizes, and skips work that grows with them
+LARGE_FILE_CHARS = 10000000
+LARGE_FILE_LINES = 200000
+LARGE_FILE_CURSORS = 2000
+# the most matches to preview in large file mode (0 to skip previews)
+LARGE_FILE_MATCH_PREVIEWS = 500
+# the number of undo levels to keep cursor positions for in large file mode
+LARGE_FILE_HISTORY = 100
+
+# how to find and preview matches for the selection: 'sourceview' to use
+#  GtkSourceView's search, which runs incrementally in the background, or 
+#  'text' to scan the document's text in Python
+SEARCH_BACKEND = 'sourceview'
 
 class MultiCursor(GObject.Object, Gedit.ViewActivatable):
   __gtype_name__ = "MultiCursor"
   view = GObject.property(type=Gedit.View)
+
+  # all active instances, so windows can find the one for each view
+  instances = [ ]
   
   def __init__(self):
     GObject.Object.__init__(self)
     # handlers we've created so we can disconnect them
     self._handlers = [ ]
+    # whether we're receiving events from the document
+    self._document_hooked = False
+    # instances for other documents that replay edits made in this one
+    self.linked = [ ]
     # whether we're inside a user action block
     self._in_user_action = False
-    # a list of functions to run when the user action is complete
-    self._user_actions = [ ]
+    # a log of edits made during the user action, to be replayed at every 
+    #  cursor when it's complete
+    self._edits = [ ]
+    # the selection offsets during the user action, updated as edits are logged
+    self._edit_selection = None
+    # the text and cursor positions from before the document was reloaded
+    self._reload = None
     # whether a paste has just happened
     self._handled_paste = False
     # the current undo stack level
@@ -25,15 +58,38 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
     self.clipboard = ''
     # a list of cursors besides the document cursor
     self.cursors = [ ]
-    # a list of tags around all instances of the matched selection text
-    self.matches = [ ]
+    # positions of cursors tracked without marks in large file mode
+    self.offsets = OffsetIndex()
+    # the backend used to find and preview matches for the selection
+    self.search = None
+    # the backends to choose from, with no sourceview one if it's not in use
+    self.text_search = None
+    self.source_search = None
+    # marks from removed cursors that are waiting to be deleted when idle
+    self._dead_marks = [ ]
+    self._dead_marks_source = None
+    # start offsets of matches that have a cursor or the selection on them
+    self._taken = set()
+    # the last regular expression used to add cursors
+    self._last_regex = ''
+    # whether the document or cursors are big enough to need large file mode
+    self.large_file = False
+    # the id and text of the message we've put on the status bar, if any
+    self._status_id = None
+    self._status_message = None
+    # the handler that checks the document's size when it's loaded
+    self._loaded_handler = None
     # map keyboard shortcuts
     self.keymap = {
       '<Primary>d': self.match_cursor,
       '<Primary><Shift>d': self.match_cursor_fuzzy,
       '<Primary>u': self.unmatch_cursor,
+      '<Primary>k': self.skip_cursor,
+      '<Primary><Alt>d': self.match_cursor_previous,
       '<Primary>Up': self.column_select_up,
       '<Primary>Down': self.column_select_down,
+      '<Primary><Alt>f': self.regex_cursors,
+      '<Primary><Alt><Shift>d': self.match_all_documents,
       'Escape': self.clear_cursors
     }
     self.compile_keymap()
@@ -53,6 +109,11 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
   def do_activate(self):
     # retain a reference to the document
     self.doc = self.view.get_buffer()
+    self.text_search = TextSearch(self)
+    if ((SEARCH_BACKEND == 'sourceview') and 
+        (hasattr(GtkSource, 'SearchContext'))):
+      self.source_search = SourceSearch(self)
+    self.search = self.text_search
     # bind events
     self.add_handler(self.view, 'event', self.on_event)
     self.add_handler(self.view, 'move-cursor', self.mc_move_cursor)
@@ -63,21 +124,58 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
     self.add_handler(self.view, 'redo', self.redo)
     self.add_handler(self.view, 'undo', self.undo_after, 'after')
     self.add_handler(self.view, 'redo', self.redo_after, 'after')
+    self.add_handler(self.view, 'draw', self.draw_cursors, 'after')
+    # documents are usually still empty when we're activated, so check 
+    #  the size again once the text is loaded, staying connected even 
+    #  when the document is unhooked
+    self._loaded_handler = self.doc.connect('loaded', 
+      lambda doc, *args: self.update_large_file_mode())
+    self.update_large_file_mode()
+    MultiCursor.instances.append(self)
   def do_deactivate(self):
     self.clear_cursors()
+    self.delete_dead_marks()
+    self.text_search.destroy()
+    if (self.source_search is not None):
+      self.source_search.destroy()
     self.remove_handlers()
+    self.doc.disconnect(self._loaded_handler)
+    self._loaded_handler = None
+    self.set_status(None)
+    MultiCursor.instances.remove(self)
+
+  # get the active instance for the given view, if any
+  @staticmethod
+  def for_view(view):
+    for instance in MultiCursor.instances:
+      if (instance.view == view):
+        return(instance)
+    return(None)
 
   # receive events from the document that control multiple cursors
   def hook_document(self):
+    if (self._document_hooked): return
+    self._document_hooked = True
     self.add_handler(self.doc, 'delete-range', self.delete)
     self.add_handler(self.doc, 'insert-text', self.insert)
     self.add_handler(self.doc, 'begin-user-action', self.begin_user_action)
     self.add_handler(self.doc, 'end-user-action', self.end_user_action, 'after')
+    self.add_handler(self.doc, 'load', self.before_reload)
+    self.add_handler(self.doc, 'loaded', self.after_reload)
     
   # stop receiving events from the document when there are no extra cursors
   def unhook_document(self):
+    if (not self._document_hooked): return
+    self._document_hooked = False
     self.remove_handlers(self.doc)
 
+  # stop receiving events from the document once there are no cursors, 
+  #  links, or matches that need to hear about edits
+  def release_document(self):
+    if ((len(self.cursors) == 0) and (len(self.linked) == 0) and
+        (self.search.text is None) and (not self.text_search.previewing)):
+      self.unhook_document()
+
   # add a signal handler for the given object
   def add_handler(self, obj, signal, handler, when=None):
     if (when == 'after'):
@@ -95,6 +193,104 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
         kept.append((obj, handler_id))
     self._handlers = kept
 
+  # switch large file mode on or off depending on the size of the document 
+  #  and the number of cursors, which are cheap to check, counting extra
+  #  cursors that are about to be added
+  def update_large_file_mode(self, extra=0):
+    large_file = ((self.doc.get_char_count() > LARGE_FILE_CHARS) or
+                  (self.doc.get_line_count() > LARGE_FILE_LINES) or
+                  (len(self.cursors) + extra > LARGE_FILE_CURSORS))
+    if (large_file == self.large_file):
+      return
+    self.large_file = large_file
+    if (large_file):
+      # take the highlighting off existing cursors in one pass
+      self.remove_cursor_tags()
+      # stop using marks for existing cursors
+      for cursor in self.cursors:
+        cursor.tag.decorate = False
+        cursor.use_offsets(self.offsets)
+    else:
+      # go back to highlighting existing cursors and tracking them with marks
+      for cursor in self.cursors:
+        cursor.use_marks()
+      self.offsets.clear()
+      self.view.queue_draw()
+    self.update_status()
+
+  # show the match counter and mode on the status bar
+  def update_status(self):
+    messages = [ ]
+    if (self.search.text is not None):
+      if (len(self.cursors) > 0):
+        (start_iter, end_iter) = (self.cursors[-1].tag.get_start_iter(),
+                                  self.cursors[-1].tag.get_end_iter())
+      else:
+        (start_iter, end_iter) = self.order_iters(self.get_selection_iters())
+      position = self.search.position(start_iter.get_offset(), 
+                                      end_iter.get_offset())
+      if (position is not None):
+        (index, count) = position
+        if (count < 0):
+          messages.append('counting matches')
+        else:
+          messages.append('match {:,} of {:,}'.format(index, count))
+    if (self.large_file):
+      messages.append('large file mode')
+    if (len(messages) > 0):
+      self.set_status('Multiple cursors: ' + ', '.join(messages))
+    else:
+      self.set_status(None)
+
+  # show a message on the window's status bar, or remove ours if it's None
+  def set_status(self, message):
+    window = self.view.get_toplevel()
+    if (not isinstance(window, Gedit.Window)):
+      return
+    # the status bar belongs to the window, so only the active view shows
+    #  its message there
+    if (window.get_active_view() != self.view):
+      message = None
+    if (message == self._status_message):
+      return
+    self._status_message = message
+    statusbar = window.get_statusbar()
+    context_id = statusbar.get_context_id('multicursor')
+    if (self._status_id is not None):
+      statusbar.remove(context_id, self._status_id)
+      self._status_id = None
+    if (message is not None):
+      self._status_id = statusbar.push(context_id, message)
+
+  # draw carets for cursors tracked without marks, which don't get drawn 
+  #  by the view, only looking up the ones that are visible
+  def draw_cursors(self, view, cr):
+    if (len(self.offsets) == 0):
+      return(False)
+    if (not Gtk.cairo_should_draw_window(cr, 
+              view.get_window(Gtk.TextWindowType.TEXT))):
+      return(False)
+    rect = view.get_visible_rect()
+    (start_iter, top) = view.get_line_at_y(rect.y)
+    (end_iter, top) = view.get_line_at_y(rect.y + rect.height)
+    if (not end_iter.ends_line()):
+      end_iter.forward_to_line_end()
+    Gdk.cairo_set_source_rgba(cr, 
+      view.get_style_context().get_color(view.get_state_flags()))
+    for key in self.offsets.keys_between(start_iter.get_offset(), 
+                                         end_iter.get_offset()):
+      tag = self.offsets.get_data(key)
+      # put carets at the end of each cursor
+      if (key != tag.end_key):
+        continue
+      location = view.get_iter_location(
+        self.doc.get_iter_at_offset(self.offsets.get(key)))
+      (x, y) = view.buffer_to_window_coords(Gtk.TextWindowType.WIDGET, 
+                                            location.x, location.y)
+      cr.rectangle(x, y, 1, location.height)
+    cr.fill()
+    return(False)
+
   def on_event(self, view, event):
     if event.type == Gdk.EventType.KEY_PRESS:
       return self.on_key_press(view, event)
@@ -138,11 +334,20 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
     text = self.doc.get_text(sel_start, sel_end, True)
     if (len(text) == 0):
       return
+    self.update_large_file_mode()
     if (len(self.cursors) > 0):
       search_start = self.cursors[-1].tag.get_end_iter()
     else:
-      self.tag_all_matches(text, fuzzy)
+      # reuse the matches if the selection was moved to one by skipping
+      if (not self.search.is_active(text, fuzzy)):
+        self.clear_matches()
+        self.tag_all_matches(text, fuzzy)
       search_start = sel_end
+    # let the search backend find the match if it's still good for this search
+    if (self.search.is_active(text, fuzzy)):
+      self.add_found_cursor(text, fuzzy, 
+        self.search.find(search_start.get_offset(), 1, self._taken))
+      return
     if (search_start.get_offset() < sel_start.get_offset()):
       search_end = sel_start
     else:
@@ -154,58 +359,172 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
       search_start = self.doc.get_start_iter()
       match = self.get_next_match(text, search_start, search_end, fuzzy)
     if (match is not None):    
-      self.add_cursor(match[0], match[1])
-      self.cursors[-1].scroll_onscreen()
-      # if there's a casing difference between the search text and the match,
-      #  attach the casing difference to the cursor and track its text
-      if (fuzzy):
-        main_casing = Casing().detect(text)
-        match_casing = Casing().detect(self.doc.get_text(match[0], match[1], True))
-        if ((match_casing.case != main_casing.case) or 
-            (match_casing.separator != main_casing.separator) or
-            (match_casing.prefix != main_casing.prefix) or
-            (match_casing.suffix != main_casing.suffix)):
-          self.cursors[-1].tracker = MarkTag(
-            self.view, 'tracker', match[0], match[1])
-          self.cursors[-1].casing = match_casing
-          if (self.tracker is None):
-            self.tracker = MarkTag(
-              self.view, 'tracker', sel_start, sel_end)
-  
+      self.add_match_cursor(text, fuzzy, match[0], match[1])
+
+  # add a cursor at a match for the given text
+  def add_match_cursor(self, text, fuzzy, start_iter, end_iter):
+    self.add_match_cursors(text, fuzzy, 
+      ((start_iter.get_offset(), end_iter.get_offset()),))
+    self.cursors[-1].scroll_onscreen()
+    if ((self.cursors[-1].casing is not None) and (self.tracker is None)):
+      self.track_selection()
+
+  # add cursors at a list of (start, end) offsets of matches for the given 
+  #  text in one pass
+  def add_match_cursors(self, text, fuzzy, ranges):
+    first = len(self.cursors)
+    self.add_cursors(ranges)
+    if (not fuzzy):
+      return
+    # if there's a casing difference between the search text and a match,
+    #  attach the casing difference to its cursor and track its text
+    main_casing = Casing().detect(text)
+    for cursor in self.cursors[first:]:
+      match_casing = Casing().detect(cursor.tag.get_text())
+      if (not match_casing.same_as(main_casing)):
+        cursor.tracker = MarkTag(self.view, 'tracker', 
+          cursor.tag.get_start_iter(), cursor.tag.get_end_iter())
+        cursor.casing = match_casing
+
+  # track the text entered at the selection so casing can be copied from it
+  def track_selection(self):
+    (sel_start, sel_end) = self.order_iters(self.get_selection_iters())
+    self.tracker = MarkTag(self.view, 'tracker', sel_start, sel_end)
+
+  # add cursors at fuzzy matches for the selection in every document in the
+  #  window, using the window's action so the search runs in its thread pool
+  def match_all_documents(self):
+    window = self.view.get_toplevel()
+    if (not isinstance(window, Gedit.Window)):
+      return
+    action = window.lookup_action(MultiCursorWindow.action_name)
+    if (action is not None):
+      action.activate(None)
+
+  # make another document's instance replay edits made in this one
+  def link(self, instance):
+    if (len(self.linked) == 0):
+      # we need to hear about edits and track casing even if there are no
+      #  matches in this document
+      self.hook_document()
+      if (self.tracker is None):
+        self.track_selection()
+    self.linked.append(instance)
+
+  # stop replaying edits in other documents and clear their cursors
+  def unlink(self):
+    # stop replaying edits made elsewhere in this document
+    for instance in MultiCursor.instances:
+      if (self in instance.linked):
+        instance.linked.remove(self)
+    linked = self.linked
+    self.linked = [ ]
+    for instance in linked:
+      instance.clear_cursors()
+
+  # apply edits made in a linked document at the cursors in this one, with 
+  #  casing copied from the text entered at the other document's selection
+  def replay_edits(self, edits, main_text):
+    if (len(self.cursors) == 0):
+      return
+    # group the edits for undo, but don't log them for replay as our
+    #  signal handlers would for edits the user makes in this document
+    self.doc.begin_user_action()
+    self._in_user_action = False
+    self.mc_replay(edits)
+    self.mc_track_casing(main_text)
+    self.doc.end_user_action()
+
+  # add a cursor at a (start, end) match from the search backend, if any
+  def add_found_cursor(self, text, fuzzy, match):
+    if (match is not None):
+      self.add_match_cursor(text, fuzzy, 
+        self.doc.get_iter_at_offset(match[0]),
+        self.doc.get_iter_at_offset(match[1]))
+    self.update_status()
+
+  # skip the most recently matched text and add a cursor at the next match,
+  #  or move the selection to the next match if there are no other cursors
+  def skip_cursor(self):
+    text = self.get_search_text()
+    if (text is None):
+      return
+    if (len(self.cursors) > 0):
+      offset = self.cursors[-1].tag.get_end_iter().get_offset()
+      self.remove_cursor(-1)
+      self.add_found_cursor(text, self.search.fuzzy, 
+                            self.search.find(offset, 1, self._taken))
+      return
+    (sel_start, sel_end) = self.order_iters(self.get_selection_iters())
+    match = self.search.find(sel_end.get_offset(), 1, self._taken)
+    if (match is not None):
+      self._taken.discard(sel_start.get_offset())
+      self._taken.add(match[0])
+      self.doc.select_range(self.doc.get_iter_at_offset(match[1]),
+                            self.doc.get_iter_at_offset(match[0]))
+      self.view.scroll_mark_onscreen(self.doc.get_insert())
+    self.update_status()
+
+  # add a cursor at the closest match before the selection that 
+  #  doesn't have one yet
+  def match_cursor_previous(self):
+    text = self.get_search_text()
+    if (text is None):
+      return
+    (sel_start, sel_end) = self.order_iters(self.get_selection_iters())
+    self.add_found_cursor(text, self.search.fuzzy,
+      self.search.find(sel_start.get_offset(), -1, self._taken))
+
+  # get the selected text, making sure the search is up to date for it, 
+  #  or return None if there's no selection
+  def get_search_text(self):
+    (sel_start, sel_end) = self.order_iters(self.get_selection_iters())
+    text = self.doc.get_text(sel_start, sel_end, True)
+    if (len(text) == 0):
+      return(None)
+    self.update_large_file_mode()
+    if (not self.search.is_active(text, self.search.fuzzy)):
+      self.clear_matches()
+      self.tag_all_matches(text, self.search.fuzzy)
+    return(text)
+
   # highlight all text that matches the selected text
   def tag_all_matches(self, text, fuzzy):
+    # in large file mode, only preview as many matches as we can afford
+    limit = None
+    if (self.large_file):
+      limit = LARGE_FILE_MATCH_PREVIEWS
+    # the sourceview backend highlights every match it finds, so it can't
+    #  stay under the limit
+    search = self.text_search
+    if ((self.source_search is not None) and (limit is None)):
+      search = self.source_search
+    if (search is not self.search):
+      self.search.clear()
+      self.search = search
+    # hear about edits so we know when the matches go out of date
+    self.hook_document()
     (sel_start, sel_end) = self.order_iters(self.get_selection_iters())
-    start_iter = self.doc.get_start_iter()
-    while (True):
-      match = self.get_next_match(text, start_iter, None, fuzzy)
-      if (match is None):
-        break
-      start_iter = match[1]
-      # don't tag the selection
-      if (match[0].get_offset() == sel_start.get_offset()):
-        continue
-      self.matches.append(MarkTag(self.view, 'multicursor_match', match[0], match[1]))
-  
+    self.search.begin(text, fuzzy, sel_start.get_offset(), limit)
+    self._taken = set(cursor.tag.get_start_iter().get_offset() 
+                      for cursor in self.cursors)
+    self._taken.add(sel_start.get_offset())
+
+  # remove all match previews
   def clear_matches(self):
-    for match in self.matches:
-      match.remove()
-    self.matches = [ ]
+    self.search.clear()
+    self._taken = set()
+    self.release_document()
+    # take down the match counter if it's showing
+    if (self._status_id is not None):
+      self.update_status()
 
   def get_next_match(self, text, search_start, search_end, fuzzy):
     flags = 0
     if (fuzzy):
       flags = Gtk.TextSearchFlags.CASE_INSENSITIVE
-      casing = Casing().detect(text)
-      alternatives = ( text, )
-      if ((casing.case != None) and (casing.separator != None)):
-        words = casing.split(text)
-        alternatives = (
-          Casing('lower', '_').join(words),
-          Casing('lower', '-').join(words),
-          Casing('lower', '').join(words)
-        )
       earliest = None
-      for alt in alternatives:
+      for alt in Casing().detect(text).alternatives(text):
         match = search_start.forward_search(alt, flags, search_end)
         if ((match is not None) and 
             ((earliest is None) or 
@@ -222,6 +541,7 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
       self.cursors[-1].scroll_onscreen()
     else:
       self.view.scroll_mark_onscreen(self.doc.get_insert())
+    self.update_status()
   
   # extend the cursor in a column to previous or subsequent lines
   def column_select_up(self):
@@ -267,38 +587,273 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
       self.add_cursor(start_iter, end_iter)
       self.cursors[-1].scroll_onscreen()
   
+  # add cursors at every match of a regular expression, searching only the
+  #  selection if the user asks for it
+  def regex_cursors(self):
+    (sel_start, sel_end) = self.order_iters(self.get_selection_iters())
+    has_selection = (sel_start.get_offset() != sel_end.get_offset())
+    options = self.prompt_regex(has_selection)
+    if (options is None): return
+    (pattern, group, in_selection) = options
+    if (in_selection):
+      self.add_regex_cursors(pattern, group, sel_start, sel_end)
+    else:
+      self.add_regex_cursors(pattern, group)
+
+  # add cursors around the given group of every match of a compiled regular
+  #  expression between the given iters, or in the whole document
+  def add_regex_cursors(self, pattern, group=0, start_iter=None, end_iter=None):
+    if (start_iter is None):
+      start_iter = self.doc.get_start_iter()
+    if (end_iter is None):
+      end_iter = self.doc.get_end_iter()
+    # search whole lines so anchors and lookarounds see the text around 
+    #  the range, only keeping matches inside it
+    line_start = self.doc.get_iter_at_line(start_iter.get_line())
+    line_end = end_iter.copy()
+    if (not line_end.ends_line()):
+      line_end.forward_to_line_end()
+    base = line_start.get_offset()
+    limit = end_iter.get_offset() - base
+    # a slice has exactly one character per buffer offset (unlike get_text, 
+    #  which skips images), so string indices map straight onto offsets
+    text = self.doc.get_slice(line_start, line_end, True)
+    ranges = [ ]
+    last_end = -1
+    for m in pattern.finditer(text, start_iter.get_offset() - base):
+      if (m.start() > limit):
+        break
+      if (m.end() > limit):
+        continue
+      (start, end) = m.span(group)
+      # skip groups that didn't participate and ranges that would overlap
+      if ((start < 0) or (start < last_end) or 
+          ((start == last_end) and (start == end))):
+        continue
+      ranges.append((base + start, base + end))
+      last_end = end
+    if (len(ranges) == 0):
+      return
+    self.clear_cursors()
+    # the first match becomes the main selection and the rest get cursors
+    (start, end) = ranges[0]
+    self.doc.select_range(self.doc.get_iter_at_offset(end), 
+                          self.doc.get_iter_at_offset(start))
+    self.add_cursors(ranges[1:])
+    self.view.scroll_mark_onscreen(self.doc.get_insert())
+
+  # ask the user for a regular expression, returning the compiled expression, 
+  #  the group to put cursors around, and whether to search only the selection,
+  #  or None if the user cancels
+  def prompt_regex(self, has_selection):
+    parent = self.view.get_toplevel()
+    if (not parent.is_toplevel()):
+      parent = None
+    dialog = Gtk.Dialog(title='Add Cursors at Matches', 
+                        transient_for=parent, modal=True)
+    dialog.add_buttons('_Cancel', Gtk.ResponseType.CANCEL,
+                       '_Add Cursors', Gtk.ResponseType.OK)
+    dialog.set_default_response(Gtk.ResponseType.OK)
+    grid = Gtk.Grid(row_spacing=6, column_spacing=6, border_width=6)
+    entry = Gtk.Entry(activates_default=True, width_chars=40)
+    entry.set_text(self._last_regex)
+    group = Gtk.SpinButton.new_with_range(0, 99, 1)
+    in_selection = Gtk.CheckButton(label='Only in selection')
+    in_selection.set_active(has_selection)
+    in_selection.set_sensitive(has_selection)
+    grid.attach(Gtk.Label(label='Pattern:', xalign=0), 0, 0, 1, 1)
+    grid.attach(entry, 1, 0, 1, 1)
+    grid.attach(Gtk.Label(label='Group:', xalign=0), 0, 1, 1, 1)
+    grid.attach(group, 1, 1, 1, 1)
+    grid.attach(in_selection, 1, 2, 1, 1)
+    dialog.get_content_area().add(grid)
+    dialog.show_all()
+    result = None
+    while (dialog.run() == Gtk.ResponseType.OK):
+      # keep the dialog open and show what's wrong if the pattern is bad
+      error = None
+      try:
+        pattern = re.compile(entry.get_text(), re.MULTILINE)
+        group_index = group.get_value_as_int()
+        if (group_index > pattern.groups):
+          error = 'The pattern has no group %d' % group_index
+      except re.error as e:
+        error = str(e)
+      if (error is not None):
+        entry.set_icon_from_icon_name(Gtk.EntryIconPosition.SECONDARY, 
+                                      'dialog-error')
+        entry.set_icon_tooltip_text(Gtk.EntryIconPosition.SECONDARY, error)
+        continue
+      self._last_regex = entry.get_text()
+      result = (pattern, group_index, in_selection.get_active())
+      break
+    dialog.destroy()
+    return(result)
+
   # add another cursor at the given position
   def add_cursor(self, start_iter, end_iter):
+    self.add_cursors(((start_iter.get_offset(), end_iter.get_offset()),))
+
+  # add cursors for a list of (start, end) offset pairs in one pass
+  def add_cursors(self, ranges):
+    if (len(ranges) == 0):
+      return
     if (len(self.cursors) == 0):
       self.hook_document()
       self.undo_level = 0
-    # add the cursor
-    cursor = Cursor(self.view, start_iter, end_iter)
-    self.cursors.append(cursor)
-    # save its initial state for the undo stack
-    cursor.save_state(self.undo_level)
+    # check the mode before adding so a big batch is never decorated
+    if (len(self.cursors) + len(ranges) > LARGE_FILE_CURSORS):
+      self.update_large_file_mode(extra=len(ranges))
+    if (self.search.text is not None):
+      self._taken.update(start for (start, end) in ranges)
+    for (start, end) in ranges:
+      # add the cursor
+      cursor = Cursor(self.view, self.doc.get_iter_at_offset(start), 
+                      self.doc.get_iter_at_offset(end), 
+                      decorate=(not self.large_file),
+                      offsets=(self.offsets if self.large_file else None))
+      self.cursors.append(cursor)
+      # save its initial state for the undo stack
+      cursor.save_state(self.undo_level)
+    self.update_large_file_mode()
 
   # remove the cursor with the given index
   def remove_cursor(self, index):
     if (len(self.cursors) > 0):
+      if (self.search.text is not None):
+        self._taken.discard(
+          self.cursors[index].tag.get_start_iter().get_offset())
       self.cursors[index].remove()
       del self.cursors[index]
-      if (len(self.cursors) == 0):
-        self.unhook_document()
+      self.release_document()
+      if ((len(self.cursors) == 0) and (len(self.linked) == 0)):
         if (self.tracker is not None):
           self.tracker.remove()
           self.tracker = None
 
+  # return whether another view of the same document has cursors or match 
+  #  previews, whose tags would be removed along with ours by a sweep of 
+  #  the whole document
+  def shares_document(self):
+    for instance in MultiCursor.instances:
+      if ((instance is not self) and (instance.doc == self.doc) and 
+          ((len(instance.cursors) > 0) or (instance.text_search.previewing))):
+        return(True)
+    return(False)
+
+  # remove the highlighting from all cursors, at once if no other view
+  #  of the document needs its highlighting kept
+  def remove_cursor_tags(self):
+    if (self.doc.get_tag_table().lookup('multicursor') is None):
+      return
+    if (self.shares_document()):
+      for cursor in self.cursors:
+        cursor.tag.remove_tag()
+    else:
+      self.doc.remove_tag_by_name('multicursor', 
+        self.doc.get_start_iter(), self.doc.get_end_iter())
+
   # remove all cursors
   def clear_cursors(self):
+    self.unlink()
     if (len(self.cursors) > 0):
-      while (len(self.cursors) > 0):
-        self.remove_cursor(-1)
+      self.remove_cursor_tags()
+      # hide the cursors now and delete their marks when idle, so the
+      #  key press or click that cleared them returns right away
+      for cursor in self.cursors:
+        self._dead_marks.extend(cursor.detach())
+      self.cursors = [ ]
+      if ((len(self._dead_marks) > 0) and (self._dead_marks_source is None)):
+        self._dead_marks_source = GLib.idle_add(self.delete_dead_marks)
+    self.unhook_document()
     self.clear_matches()
     if (self.tracker is not None):
       self.tracker.remove()
       self.tracker = None
+    self.offsets.clear()
+    # remove the mark used to scroll to cursors without marks
+    scroll_mark = self.doc.get_mark(OffsetTag.scroll_mark_name)
+    if (scroll_mark is not None):
+      self.doc.delete_mark(scroll_mark)
+    self.update_large_file_mode()
       
+  # delete the marks of cleared cursors
+  def delete_dead_marks(self):
+    if (self._dead_marks_source is not None):
+      GLib.source_remove(self._dead_marks_source)
+      self._dead_marks_source = None
+    for mark in self._dead_marks:
+      if (not mark.get_deleted()):
+        self.doc.delete_mark(mark)
+    self._dead_marks = [ ]
+    return(False)
+
+  # remember the text and where everything is before the document is 
+  #  reloaded, since reloading replaces all the text
+  def before_reload(self, doc, *args):
+    tags = [ ]
+    if (self.tracker is not None):
+      tags.append(self.tracker)
+    for cursor in self.cursors:
+      tags.append(cursor.tag)
+      if (cursor.tracker is not None):
+        tags.append(cursor.tracker)
+    self._reload = (
+      self.doc.get_slice(self.doc.get_start_iter(), 
+                         self.doc.get_end_iter(), True),
+      dict((tag, (tag.get_start_iter().get_offset(), 
+                  tag.get_end_iter().get_offset())) for tag in tags))
+  # move everything to where the same text is after the document is reloaded,
+  #  dropping cursors whose text changed
+  def after_reload(self, doc, *args):
+    if (self._reload is None): return
+    (old_text, positions) = self._reload
+    self._reload = None
+    # older versions of gedit pass an error if loading failed
+    if ((len(args) > 0) and (args[0] is not None)):
+      self.clear_cursors()
+      return
+    self.clear_matches()
+    offset_map = OffsetMap(old_text, self.doc.get_slice(
+      self.doc.get_start_iter(), self.doc.get_end_iter(), True))
+    # move a tag to its new position, returning whether it could be moved
+    def remap(tag):
+      (start, end) = positions[tag]
+      (start, end) = (offset_map.get(start), offset_map.get(end))
+      if ((start is None) or (end is None)):
+        return(False)
+      tag.do_move_marks(self.doc.get_iter_at_offset(start), 
+                        self.doc.get_iter_at_offset(end))
+      return(True)
+    if ((self.tracker is not None) and (not remap(self.tracker))):
+      self.tracker.remove()
+      self.tracker = None
+    keep_cursors = [ ]
+    for cursor in self.cursors:
+      if (not remap(cursor.tag)):
+        cursor.remove()
+        continue
+      # stop copying casing to a cursor if we lose track of its text
+      if ((cursor.tracker is not None) and (not remap(cursor.tracker))):
+        cursor.tracker.remove()
+        cursor.tracker = None
+        cursor.casing = None
+      cursor.remap_state(offset_map)
+      cursor.save_state(self.undo_level)
+      keep_cursors.append(cursor)
+    self.cursors = keep_cursors
+    if ((len(self.cursors) == 0) and (len(self.linked) == 0)):
+      self.clear_cursors()
+      return
+    # start tracking the selection again if casing still needs copying
+    if ((self.tracker is None) and 
+        ((len(self.linked) > 0) or 
+         (any((cursor.casing is not None) for cursor in self.cursors)))):
+      self.track_selection()
+    self.update_large_file_mode()
+    if (len(self.offsets) > 0):
+      self.view.queue_draw()
+
   # restore cursor state after undo and redo operations
   def undo(self, view):
     undo_manager = self.doc.get_undo_manager()
@@ -324,84 +879,141 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
     for cursor in self.cursors:
       cursor.recall_state(self.undo_level)
   
-  # schedule a multicursor insert for when the user's action is done
+  # log an insert to replay at every cursor when the user's action is done
   def insert(self, doc, start, text, length):
-    # if this is part of a user action, store and apply it at the end
-    if (self._in_user_action):
-      # get the offset from the insertion point
-      (sel_start, sel_end) = self.order_iters(self.get_selection_iters())
-      start_delta = start.get_offset() - sel_start.get_offset()
-      # schedule this for when the user action is done
-      self.store_user_action(self.mc_insert, (start_delta, text))
-
-  # schedule a multicursor delete for when the user's action is done
+    position = start.get_offset()
+    # shift cursors and previews that aren't tracked by marks
+    if (len(self.offsets) > 0):
+      self.offsets.insert(position, len(text))
+    self.text_search.insert(position, len(text))
+    # matches found so far are out of date once the text changes
+    if (self.search.text is not None):
+      self.search.invalidate()
+    if (not self._in_user_action):
+      return
+    selection = self._edit_selection
+    last = (self._edits[-1] if (len(self._edits) > 0) else None)
+    # if a paste was just handled and we're inserting the global clipboard 
+    #  contents, each cursor will insert its own clipboard contents
+    kind = 'insert'
+    if (self._handled_paste):
+      if (text == self.clipboard):
+        kind = 'paste'
+      # any paste action results in an insertion, so clear for next time
+      self._handled_paste = False
+    # join inserts that continue on from the last one, like auto-indentation
+    #  after a newline
+    if ((kind == 'insert') and (last is not None) and (last[0] == 'insert') and
+        (last[3] + len(last[2]) == position)):
+      last[2] += text
+    else:
+      self._edits.append([ kind, position - selection[0], text, position ])
+    # move the selection like the insert and selection bound marks will move
+    for i in (0, 1):
+      if (selection[i] >= position):
+        selection[i] += len(text)
+
+  # log a delete to replay at every cursor when the user's action is done
   def delete(self, doc, start, end):
-    # if this is part of a user action, store and apply it at the end
-    if (self._in_user_action):
-      # get the offset of the range from the insertion point
-      (start, end) = self.order_iters((start, end))
-      (sel_start, sel_end) = self.order_iters(self.get_selection_iters())
-      start_delta = start.get_offset() - sel_start.get_offset()
-      end_delta = end.get_offset() - sel_end.get_offset()
-      # schedule this for when the user action is done
-      self.store_user_action(self.mc_delete, (start_delta, end_delta))
-
-  # clear the schedule of functions to be applied
+    (start, end) = sorted((start.get_offset(), end.get_offset()))
+    # shift cursors and previews that aren't tracked by marks
+    if (len(self.offsets) > 0):
+      self.offsets.delete(start, end)
+    self.text_search.delete(start, end)
+    if (self.search.text is not None):
+      self.search.invalidate()
+    if (not self._in_user_action):
+      return
+    selection = self._edit_selection
+    last = (self._edits[-1] if (len(self._edits) > 0) else None)
+    # deleting text inserted earlier in the same action just shortens the 
+    #  insert, as long as there's no selection the delete could depend on
+    if ((last is not None) and (last[0] == 'insert') and 
+        (selection[0] == selection[1]) and
+        (last[3] <= start) and (end <= last[3] + len(last[2]))):
+      last[2] = last[2][:start - last[3]] + last[2][end - last[3]:]
+      if (len(last[2]) == 0):
+        self._edits.pop()
+    else:
+      # the start of the range is relative to the start of the selection 
+      #  and the end to its end, so cursors delete their own selections
+      self._edits.append(
+        [ 'delete', start - selection[0], end - selection[1], start ])
+    # move the selection like the insert and selection bound marks will move
+    for i in (0, 1):
+      if (selection[i] > end):
+        selection[i] -= (end - start)
+      elif (selection[i] > start):
+        selection[i] = start
+
+  # start logging edits relative to the current selection
   def begin_user_action(self, doc=None):
     # save the state of all the cursors before the user does something
     for cursor in self.cursors:
       cursor.save_state(self.undo_level)
-    self._user_actions = [ ]
+    (sel_start, sel_end) = self.order_iters(self.get_selection_iters())
+    self._edit_selection = [ sel_start.get_offset(), sel_end.get_offset() ]
+    self._edits = [ ]
     self._in_user_action = True
-  # schedule a function to be run when end_user_action is called
-  def store_user_action(self, action, args):
-    if (self._in_user_action):
-      self._user_actions.append((action, args))
-  # run scheduled functions
+  # replay the logged edits at every cursor
   def end_user_action(self, doc=None):
     self._in_user_action = False
     # remove all match previews now that the user is doing something
     self.clear_matches()
-    # execute the scheduled actions
-    for (action, args) in self._user_actions:
-      action(*args)
-    self._user_actions = [ ]
+    # replay the edits without their positions in the main document
+    edits = [ (kind, delta, payload) 
+              for (kind, delta, payload, position) in self._edits ]
+    self._edits = [ ]
+    self.mc_replay(edits)
     # update casing information
     self.mc_track_casing()
+    # make the same edits in linked documents
+    if (len(self.linked) > 0):
+      # without a tracker there's no casing to copy, so copy none
+      main_text = ''
+      if (self.tracker is not None):
+        main_text = self.tracker.get_text()
+      for instance in self.linked:
+        instance.replay_edits(edits, main_text)
     # save the state of all the cursors after the user does something
     self.undo_level += 1
     for cursor in self.cursors:
       cursor.save_state(self.undo_level)
-    
-
-  # insert text at every cursor
-  def mc_insert(self, start_delta, text):
-    # if a paste was just handled and we're inserting the global clipboard contents,
-    #  insert local clipboard contents for each cursor
-    if ((self._handled_paste) and (text == self.clipboard)):
-      for cursor in self.cursors:
-        if ((cursor.clipboard is not None) and (len(cursor.clipboard) > 0)):
-          cursor.insert(start_delta, cursor.clipboard)
-        else:
-          cursor.insert(start_delta, text)
-    else:
+    # in large file mode, only keep cursor positions for recent undo levels
+    self.update_large_file_mode()
+    if (self.large_file):
       for cursor in self.cursors:
-        cursor.insert(start_delta, text)
-    # any paste action has resulted in an insertion, so clear for next time
-    self._handled_paste = False
+        if (len(cursor.state) > 2 * LARGE_FILE_HISTORY):
+          cursor.trim_state(self.undo_level - LARGE_FILE_HISTORY)
+    if (len(self.offsets) > 0):
+      self.view.queue_draw()
 
-  # delete text at every cursor
-  def mc_delete(self, start_delta, end_delta):
-    # do the delete relative to all cursors
+  # apply a log of (kind, delta, payload) edits at every cursor, 
+  #  doing all the edits for one cursor before moving on to the next
+  def mc_replay(self, edits):
+    if (len(edits) == 0):
+      return
     for cursor in self.cursors:
-      cursor.delete(start_delta, end_delta)
-
-  # update any cursors that track casing
-  def mc_track_casing(self):
-    # if we're not tracking casing, there's nothing to do
-    if (self.tracker is None): return
-    # get the casing of the text entered at the main cursor    
-    main_text = self.tracker.get_text()
+      for (kind, delta, payload) in edits:
+        if (kind == 'insert'):
+          cursor.insert(delta, payload)
+        elif (kind == 'paste'):
+          # insert local clipboard contents if the cursor has any
+          if ((cursor.clipboard is not None) and (len(cursor.clipboard) > 0)):
+            cursor.insert(delta, cursor.clipboard)
+          else:
+            cursor.insert(delta, payload)
+        elif (kind == 'delete'):
+          cursor.delete(delta, payload)
+
+  # update any cursors that track casing, copying it from the given text
+  #  or the text entered at the main cursor
+  def mc_track_casing(self, main_text=None):
+    if (main_text is None):
+      # if we're not tracking casing, there's nothing to do
+      if (self.tracker is None): return
+      # get the casing of the text entered at the main cursor    
+      main_text = self.tracker.get_text()
     main_casing = Casing().detect(main_text)
     words = main_casing.split(main_text)
     if (not main_casing.is_keyword()): return
@@ -422,6 +1034,9 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
       return
     for cursor in self.cursors:
       cursor.move(step_size, count, extend_selection)
+    # carets for cursors without marks are only drawn by us
+    if (len(self.offsets) > 0):
+      self.view.queue_draw()
     
   # copy the selection at every cursor
   def mc_save_clipboard(self, view):
@@ -434,16 +1049,398 @@ class MultiCursor(GObject.Object, Gedit.ViewActivatable):
   def mc_paste_clipboard(self, view):
     self._handled_paste = True
 
+# this class finds and previews matches for the selection by scanning the 
+#  document's text in Python, keeping a sorted index of the matches so 
+#  nearby ones can be found without searching again
+class TextSearch:
+
+  # the number of characters to copy out of the document at a time when
+  #  searching without an index
+  chunk_size = 1 << 16
+  # how far past the selection to look for matches to preview when 
+  #  searching without an index
+  preview_range = 1 << 20
+
+  def __init__(self, plugin):
+    self.plugin = plugin
+    self.doc = plugin.doc
+    # the text and fuzziness being searched for, or None for the text if 
+    #  there's no search or the document has changed since
+    self.text = None
+    self.fuzzy = False
+    # sorted start offsets of all matches, and end offsets for each
+    self.starts = [ ]
+    self.ends = [ ]
+    # whether the matches above cover the whole document, or are found 
+    #  as they're needed by scanning in chunks
+    self.indexed = True
+    # the compiled search and the longest text it can match
+    self.pattern = None
+    self.max_length = 0
+    # whether any matches are being previewed
+    self.previewing = False
+    # the positions of previews, kept without marks, and (start, end) keys 
+    #  for them, so previews can be removed one by one when the whole 
+    #  document can't be swept
+    self.previews = OffsetIndex()
+    self._preview_keys = [ ]
+
+  # find and preview matches for the given text, except at the given
+  #  offset; with no limit, all matches are indexed in one pass, and with 
+  #  a limit, matches are found in chunks as they're needed and only up 
+  #  to limit matches near the offset are previewed
+  def begin(self, text, fuzzy, exclude_offset, limit=None):
+    self.clear()
+    self.text = text
+    self.fuzzy = fuzzy
+    if (fuzzy):
+      casing = Casing().detect(text)
+      self.pattern = re.compile(casing.pattern(text), re.IGNORECASE)
+      self.max_length = max(len(alt) for alt in casing.alternatives(text))
+    else:
+      self.pattern = re.compile(re.escape(text))
+      self.max_length = len(text)
+    self.indexed = (limit is None)
+    if (self.indexed):
+      # a slice has exactly one character per buffer offset
+      content = self.doc.get_slice(
+        self.doc.get_start_iter(), self.doc.get_end_iter(), True)
+      for m in self.pattern.finditer(content):
+        self.starts.append(m.start())
+        self.ends.append(m.end())
+      matches = zip(self.starts, self.ends)
+    else:
+      matches = self.scan_forward(exclude_offset, min(
+        exclude_offset + TextSearch.preview_range, self.doc.get_char_count()))
+    tag = self.get_tag()
+    previews = 0
+    for (start, end) in matches:
+      if (start == exclude_offset):
+        continue
+      if ((limit is not None) and (previews >= limit)):
+        break
+      previews += 1
+      self.doc.apply_tag(tag, self.doc.get_iter_at_offset(start), 
+                         self.doc.get_iter_at_offset(end))
+      self._preview_keys.append((self.previews.add(start, False),
+                                 self.previews.add(end, True)))
+    self.previewing = (previews > 0)
+
+  # get (start, end) offsets of matches starting between the given offsets
+  #  in order, copying the document out a chunk at a time
+  def scan_forward(self, pos, bound):
+    char_count = self.doc.get_char_count()
+    while (pos < bound):
+      chunk_end = min(pos + TextSearch.chunk_size, bound)
+      # take in enough past the chunk to finish a match that starts in it
+      content = self.doc.get_slice(self.doc.get_iter_at_offset(pos), 
+        self.doc.get_iter_at_offset(
+          min(chunk_end + self.max_length, char_count)), True)
+      next_pos = chunk_end
+      for m in self.pattern.finditer(content):
+        if (pos + m.start() >= chunk_end):
+          break
+        next_pos = max(next_pos, pos + m.end())
+        yield((pos + m.start(), pos + m.end()))
+      pos = next_pos
+
+  # get (start, end) offsets of matches starting between the given offsets
+  #  in reverse order, copying the document out a chunk at a time
+  def scan_backward(self, pos, bound):
+    char_count = self.doc.get_char_count()
+    while (pos > bound):
+      chunk_start = max(pos - TextSearch.chunk_size, bound)
+      content = self.doc.get_slice(self.doc.get_iter_at_offset(chunk_start),
+        self.doc.get_iter_at_offset(
+          min(pos + self.max_length, char_count)), True)
+      matches = [ (chunk_start + m.start(), chunk_start + m.end()) 
+                  for m in self.pattern.finditer(content)
+                  if (chunk_start + m.start() < pos) ]
+      for match in reversed(matches):
+        yield(match)
+      pos = chunk_start
+
+  # return whether the search is still good for the given text and fuzziness
+  def is_active(self, text, fuzzy):
+    return((self.text is not None) and 
+           (self.text == text) and (self.fuzzy == fuzzy))
+
+  # get the (start, end) offsets of the closest match starting at or after 
+  #  the given offset (or before it if direction is negative) whose start 
+  #  isn't in taken, wrapping around the document, or None if there isn't one
+  def find(self, offset, direction, taken):
+    if (not self.indexed):
+      char_count = self.doc.get_char_count()
+      if (direction < 0):
+        matches = chain(self.scan_backward(offset, 0), 
+                        self.scan_backward(char_count, offset))
+      else:
+        matches = chain(self.scan_forward(offset, char_count),
+                        self.scan_forward(0, offset))
+      for (start, end) in matches:
+        if (start not in taken):
+          return((start, end))
+      return(None)
+    count = len(self.starts)
+    index = bisect_left(self.starts, offset)
+    if (direction < 0):
+      index -= 1
+    for step in range(count):
+      i = (index + (step * direction)) % count
+      if (self.starts[i] not in taken):
+        return((self.starts[i], self.ends[i]))
+    return(None)
+
+  # get the 1-based index of the match at the given offsets and the number
+  #  of matches, or None if there's no match there or matches aren't indexed
+  def position(self, start, end):
+    if (not self.indexed):
+      return(None)
+    index = bisect_left(self.starts, start)
+    if ((index < len(self.starts)) and (self.starts[index] == start)):
+      return((index + 1, len(self.starts)))
+    return(None)
+
+  # forget the matches once the text has changed
+  def invalidate(self):
+    self.text = None
+    self.starts = [ ]
+    self.ends = [ ]
+
+  # shift previews for text inserted or deleted in the document
+  def insert(self, offset, length):
+    if (len(self.previews) > 0):
+      self.previews.insert(offset, length)
+  def delete(self, start, end):
+    if (len(self.previews) > 0):
+      self.previews.delete(start, end)
+
+  # remove all previews and forget the matches
+  def clear(self):
+    if (self.previewing):
+      # sweep the whole document unless another view needs its previews
+      self.previewing = False
+      if (self.plugin.shares_document()):
+        tag = self.get_tag()
+        for (start_key, end_key) in self._preview_keys:
+          self.doc.remove_tag(tag, 
+            self.doc.get_iter_at_offset(self.previews.get(start_key)),
+            self.doc.get_iter_at_offset(self.previews.get(end_key)))
+      else:
+        self.doc.remove_tag_by_name('multicursor_match', 
+          self.doc.get_start_iter(), self.doc.get_end_iter())
+      self.previews.clear()
+      self._preview_keys = [ ]
+    self.invalidate()
+
+  def destroy(self):
+    self.clear()
+
+  # get the tag used to preview matches
+  def get_tag(self):
+    tag = self.doc.get_tag_table().lookup('multicursor_match')
+    if (tag is None):
+      tag = self.doc.create_tag('multicursor_match', 
+                                underline=Pango.Underline.SINGLE)
+    return(tag)
+
+
+# this class finds and previews matches for the selection using a
+#  GtkSource.SearchContext, which finds and counts matches incrementally 
+#  in the background and keeps them up to date as the document changes
+class SourceSearch:
+
+  def __init__(self, plugin):
+    self.doc = plugin.doc
+    # the text and fuzziness being searched for, or None for the text if 
+    #  there's no search or the document has changed since
+    self.text = None
+    self.fuzzy = False
+    self.settings = GtkSource.SearchSettings(wrap_around=True)
+    self.context = GtkSource.SearchContext(
+      buffer=self.doc, settings=self.settings, highlight=False)
+    # update the match counter as the context counts matches
+    self._handler = self.context.connect('notify::occurrences-count', 
+      lambda context, param: plugin.update_status())
+
+  # find and preview all matches for the given text, which can't be limited
+  #  since the context highlights matches as it finds them, and doesn't need
+  #  to exclude the selection since the selection is drawn over its highlight
+  def begin(self, text, fuzzy, exclude_offset, limit=None):
+    self.text = text
+    self.fuzzy = fuzzy
+    # fuzzy matches need a regular expression to match all the casing variants
+    self.settings.set_regex_enabled(fuzzy)
+    self.settings.set_case_sensitive(not fuzzy)
+    if (fuzzy):
+      self.settings.set_search_text(Casing().detect(text).pattern(text))
+    else:
+      self.settings.set_search_text(text)
+    self.context.set_highlight(True)
+
+  def is_active(self, text, fuzzy):
+    return((self.text is not None) and 
+           (self.text == text) and (self.fuzzy == fuzzy))
+
+  # get the (start, end) offsets of the closest match starting at or after 
+  #  the given offset (or before it if direction is negative) whose start 
+  #  isn't in taken, wrapping around the document, or None if there isn't one
+  def find(self, offset, direction, taken):
+    pos = self.doc.get_iter_at_offset(offset)
+    first = None
+    while (True):
+      # newer versions of GtkSourceView also say whether they wrapped around
+      if (direction < 0):
+        result = self.context.backward(pos)
+      else:
+        result = self.context.forward(pos)
+      (found, start_iter, end_iter) = result[:3]
+      if (not found):
+        return(None)
+      start = start_iter.get_offset()
+      # stop once we've been all the way around
+      if (start == first):
+        return(None)
+      if (first is None):
+        first = start
+      if (start not in taken):
+        return((start, end_iter.get_offset()))
+      pos = (start_iter if (direction < 0) else end_iter)
+
+  # get the 1-based index of the match at the given offsets and the number
+  #  of matches, using -1 for the count while matches are still being 
+  #  counted, or None if there's no match there
+  def position(self, start, end):
+    index = self.context.get_occurrence_position(
+      self.doc.get_iter_at_offset(start), self.doc.get_iter_at_offset(end))
+    if (index == 0):
+      return(None)
+    count = self.context.get_occurrences_count()
+    if (index < 0):
+      count = -1
+    return((index, count))
+
+  # the context keeps its matches up to date as the text changes, but the 
+  #  plugin's record of which ones have cursors doesn't
+  def invalidate(self):
+    self.text = None
+
+  # stop highlighting and counting matches
+  def clear(self):
+    self.text = None
+    self.context.set_highlight(False)
+    self.settings.set_search_text(None)
+
+  def destroy(self):
+    self.clear()
+    self.context.disconnect(self._handler)
+
+
+# find the (start, end) offsets of all matches for a compiled regular 
+#  expression in a snapshot of a document's text, which is safe to do
+#  off the main thread
+def find_spans(pattern, text):
+  return([ m.span() for m in pattern.finditer(text) ])
+
+
+# this class adds actions to a gedit window that work across all of its documents
+class MultiCursorWindow(GObject.Object, Gedit.WindowActivatable):
+  __gtype_name__ = "MultiCursorWindow"
+  window = GObject.property(type=Gedit.Window)
+
+  # the name of the action to match the selection in all documents
+  action_name = 'multicursor-match-all-documents'
+
+  def __init__(self):
+    GObject.Object.__init__(self)
+    # a pool of threads for searching documents, created when needed
+    self._executor = None
+    self._tab_changed_handler = None
+
+  def do_activate(self):
+    action = Gio.SimpleAction(name=MultiCursorWindow.action_name)
+    action.connect('activate', self.match_all_documents)
+    self.window.add_action(action)
+    self._tab_changed_handler = self.window.connect(
+      'active-tab-changed', self.on_active_tab_changed)
+  def do_deactivate(self):
+    self.window.remove_action(MultiCursorWindow.action_name)
+    self.window.disconnect(self._tab_changed_handler)
+    self._tab_changed_handler = None
+    if (self._executor is not None):
+      self._executor.shutdown(wait=False)
+      self._executor = None
+  def do_update_state(self):
+    pass
+
+  # the status bar is shared by the window's views, so show the message
+  #  for the view that's now active and take down the others
+  def on_active_tab_changed(self, window, tab):
+    for instance in MultiCursor.instances:
+      if (instance.view.get_toplevel() == self.window):
+        instance.update_status()
+
+  # add cursors at every fuzzy match for the active view's selection in all 
+  #  open documents, so typing at the selection renames them all
+  def match_all_documents(self, action=None, parameter=None):
+    main = MultiCursor.for_view(self.window.get_active_view())
+    if (main is None):
+      return
+    (sel_start, sel_end) = main.order_iters(main.get_selection_iters())
+    text = main.doc.get_text(sel_start, sel_end, True)
+    if (len(text) == 0):
+      return
+    # start fresh in every document
+    main.clear_cursors()
+    instances = [ main ]
+    docs = [ main.doc ]
+    for view in self.window.get_views():
+      instance = MultiCursor.for_view(view)
+      if ((instance is None) or (instance.doc in docs)):
+        continue
+      instance.clear_cursors()
+      instances.append(instance)
+      docs.append(instance.doc)
+    # search snapshots of each document's text in parallel, since the 
+    #  buffers themselves can only be touched from the main thread
+    pattern = re.compile(Casing().detect(text).pattern(text), re.IGNORECASE)
+    if (self._executor is None):
+      self._executor = ThreadPoolExecutor()
+    futures = [ self._executor.submit(find_spans, pattern, 
+                  doc.get_slice(doc.get_start_iter(), doc.get_end_iter(), True))
+                for doc in docs ]
+    # don't put a cursor on the selection itself
+    selection = (sel_start.get_offset(), sel_end.get_offset())
+    for (instance, future) in zip(instances, futures):
+      spans = future.result()
+      if (instance is main):
+        spans = [ span for span in spans if (span != selection) ]
+      elif (len(spans) == 0):
+        continue
+      else:
+        main.link(instance)
+      instance.add_match_cursors(text, True, spans)
+    # casing only needs tracking if there's somewhere to copy it to
+    if ((main.tracker is None) and 
+        ((len(main.cursors) > 0) or (len(main.linked) > 0))):
+      main.track_selection()
+    main.update_status()
+
 
 # this class manages a single extra cursor in the document
 class Cursor:
 
-  def __init__(self, view, start_iter, end_iter):
+  def __init__(self, view, start_iter, end_iter, decorate=True, offsets=None):
     # hook to the document
     self.view = view
     self.doc = self.view.get_buffer()
-    # add marks for the cursor and selection area
-    self.tag = MarkTag(self.view, 'multicursor', start_iter, end_iter)
+    # add marks for the cursor and selection area, or track the cursor in 
+    #  an OffsetIndex if one is given
+    if (offsets is not None):
+      self.tag = OffsetTag(self.view, offsets, 'multicursor', 
+                           start_iter, end_iter, decorate)
+    else:
+      self.tag = MarkTag(self.view, 'multicursor', start_iter, end_iter, decorate)
     # add properties for tracking any inserted text
     self.tracker = None
     # add a property to store the casing convention to use for insertion
@@ -456,6 +1453,28 @@ class Cursor:
     self.state = dict()
     self.initial_state_index = None
     
+  # switch to tracking the cursor in an OffsetIndex instead of with marks
+  def use_offsets(self, offsets):
+    if (isinstance(self.tag, OffsetTag)):
+      return
+    start_iter = self.tag.get_start_iter()
+    end_iter = self.tag.get_end_iter()
+    decorate = self.tag.decorate
+    self.tag.remove()
+    self.tag = OffsetTag(self.view, offsets, 'multicursor', 
+                         start_iter, end_iter, decorate)
+
+  # switch back to tracking the cursor with marks, highlighting it again
+  def use_marks(self):
+    if (not isinstance(self.tag, OffsetTag)):
+      self.tag.decorate = True
+      self.tag.do_move_marks()
+      return
+    start_iter = self.tag.get_start_iter()
+    end_iter = self.tag.get_end_iter()
+    self.tag.remove()
+    self.tag = MarkTag(self.view, 'multicursor', start_iter, end_iter)
+
   # save the text to the local clipboard
   def save_text(self):
     self.clipboard = self.tag.get_text()
@@ -468,6 +1487,20 @@ class Cursor:
     }
     if (self.initial_state_index is None):
       self.initial_state_index = index
+  # forget states saved before the given index
+  def trim_state(self, index):
+    for key in [ key for key in self.state if (key < index) ]:
+      del self.state[key]
+  # move saved states to where their text is in a new version of the 
+  #  document, forgetting any that are in text that changed
+  def remap_state(self, offset_map):
+    new_state = dict()
+    for (index, state) in self.state.items():
+      start = offset_map.get(state['start'])
+      end = offset_map.get(state['end'])
+      if ((start is not None) and (end is not None)):
+        new_state[index] = { 'start': start, 'end': end }
+    self.state = new_state
   # recall the state at the given index
   def recall_state(self, index):
     if (index not in self.state):
@@ -479,7 +1512,7 @@ class Cursor:
 
   # scroll so that this cursor is on-screen
   def scroll_onscreen(self):
-    self.view.scroll_mark_onscreen(self.tag.end_mark)
+    self.tag.scroll_onscreen()
 
   # remove the cursor from the document
   def remove(self):
@@ -487,6 +1520,14 @@ class Cursor:
     if (self.tracker is not None):
       self.tracker.remove()
 
+  # hide the cursor and stop tracking it without removing its tag, returning
+  #  any marks that still need to be deleted
+  def detach(self):
+    marks = self.tag.detach()
+    if (self.tracker is not None):
+      marks.extend(self.tracker.detach())
+    return(marks)
+
   # insert text at the cursor
   def insert(self, start_delta, text):
     start_iter = self.doc.get_iter_at_offset(
@@ -660,10 +1701,12 @@ class Cursor:
 # this class manages a GtkTextTag, anchoring it with GtkTextMarks instead of GtkTextIters
 class MarkTag:
 
-  def __init__(self, view, name, start_iter, end_iter):
+  def __init__(self, view, name, start_iter, end_iter, decorate=True):
     self.view = view
     self.doc = self.view.get_buffer()
     self.name = name
+    # whether to highlight the tagged text
+    self.decorate = decorate
     self.start_mark = self.doc.create_mark(None, start_iter, True)
     self.end_mark = self.doc.create_mark(None, end_iter, False)
     # update the tag for its initial position
@@ -696,8 +1739,8 @@ class MarkTag:
   # move the start and end marks to the specified locations, doing nothing
   #  if the locations are not changing
   def move_marks(self, new_start_iter=None, new_end_iter=None):
-    start_iter = self.doc.get_iter_at_mark(self.start_mark)
-    end_iter = self.doc.get_iter_at_mark(self.end_mark)
+    start_iter = self.get_start_iter()
+    end_iter = self.get_end_iter()
     if (((new_start_iter is not None) and 
          (new_start_iter.get_offset() != start_iter.get_offset())) or
         ((new_end_iter is not None) and 
@@ -727,7 +1770,10 @@ class MarkTag:
       self.doc.delete_mark(self.start_mark)
       self.start_mark = self.doc.create_mark(None, start_iter, capture)
       self.start_mark.set_visible(visible)
-      
+
+  # scroll so that the end of the tag is on-screen
+  def scroll_onscreen(self):
+    self.view.scroll_mark_onscreen(self.end_mark)
       
   # remove the tag and marks from the document
   def remove(self):
@@ -736,12 +1782,21 @@ class MarkTag:
     self.doc.delete_mark(self.start_mark)
     self.doc.delete_mark(self.end_mark)
 
+  # hide the marks without removing the tag, returning the marks so the 
+  #  caller can delete them along with others
+  def detach(self):
+    if (self.start_mark.get_visible()):
+      self.start_mark.set_visible(False)
+    return([ self.start_mark, self.end_mark ])
+
   # add a tag between the marks
   def add_tag(self):
+    if (not self.decorate):
+      return
     tag = self.get_tag()
+    start_iter = self.get_start_iter()
+    end_iter = self.get_end_iter()
     if (tag is not None):
-      start_iter = self.doc.get_iter_at_mark(self.start_mark)
-      end_iter = self.doc.get_iter_at_mark(self.end_mark)
       self.doc.apply_tag(tag, start_iter, end_iter)
     # remove search match tags on the cursor to avoid visual tag collision
     if (self.name == 'multicursor'):
@@ -751,9 +1806,11 @@ class MarkTag:
 
   # remove the tag from between the marks if there is one
   def remove_tag(self):
+    if (not self.decorate):
+      return
     if (self.doc.get_tag_table().lookup(self.name) is not None):
-      start_iter = self.doc.get_iter_at_mark(self.start_mark)
-      end_iter = self.doc.get_iter_at_mark(self.end_mark)
+      start_iter = self.get_start_iter()
+      end_iter = self.get_end_iter()
       self.doc.remove_tag_by_name(self.name, start_iter, end_iter)
 
   # get a styled tag to place between the marks
@@ -770,10 +1827,6 @@ class MarkTag:
         tag = self.doc.create_tag(self.name, 
                                    background=background, 
                                    foreground=foreground)
-      # style a preview of a match to the selection
-      elif (self.name == 'multicursor_match'):
-        tag = self.doc.create_tag(self.name, 
-                                  underline=Pango.Underline.SINGLE)
       # style an invisible set of marks
       elif (self.name == 'tracker'):
         tag = None
@@ -802,102 +1855,75 @@ class MarkTag:
 
 
 
-# this class handles detection and conversion between different casing conventions
-class Casing:
-  
-  # regexes
-  match_surround = re.compile(r'^([_-]*)(.*?)([_-]*)$')
-  match_cases = OrderedDict([
-    # to be lower case, either there must be at least one lower case character and no 
-    #  upper case ones or it must be in camelCase beginning with a lower case character
-    ('case', re.compile(r'^([a-z0-9_-]*[a-z]+[a-z0-9_-]*|[a-z][A-Za-z0-9]*)$')),
-    # to be upper case, there must be at least one upper case character and no lower case ones
-    ('CASE', re.compile(r'^[A-Z0-9_-]*[A-Z]+[A-Z0-9_-]*$')),
-    # to be title case, there must be at least one upper+lower combo or it must be CamelCase
-    #  beginning with an upper case character
-    ('Case', re.compile(r'^([\w-]*[A-Z][a-z][\w-]*|[A-Z][a-z][A-Za-z0-9]*)$'))
-  ])
-  match_separators = OrderedDict([
-    # this one handles single words in one case, where we can't know what the separator might be
-    (None, re.compile(r'^([A-Z0-9]+|[a-z0-9]+|[A-Z][a-z][a-z0-9]*)$')),
-    # this handles camelCase, treated as an empty separator
-    ('', re.compile(r'^[A-Za-z0-9]+$')),
-    # this handles the usual kind of word separators
-    ('_', re.compile(r'^[\w]+$')),
-    ('-', re.compile(r'^[A-Za-z0-9-]+$'))
-  ])
-  
-  def __init__(self, case=None, separator=None, prefix='', suffix=''):
-    # the case used for words in the string ('case', 'CASE', or 'Case')
-    self.case = case
-    # the separator used between words in the string, 
-    #  ('' for camelCase or CamelCase, '_' for snake_case or CONSTANT_CASE, 
-    #   and '-' for things like css-classes)
-    self.separator = separator
-    # optional strings at the beginning or end of the string
-    self.prefix = prefix
-    self.suffix = suffix
-    
-  # return whether the detected casing looks like a keyword
-  def is_keyword(self):
-    return((self.case is not None) or (self.separator is not None))
-  
-  # detect the casing convention for the given string and return an instance
-  #  with all properties set to the detected values or None if the text was
-  #  indeterminate in some way (e.g. you can't detect a separator from a single word)
-  def detect(self, text):
-    # remove prefixes and suffixes
-    m = Casing.match_surround.match(text)
-    if (m):
-      self.prefix = m.group(1)
-      text = m.group(2)
-      self.suffix = m.group(3)
-    # detect case and separator
-    for (key, pattern) in Casing.match_cases.items():
-      if (pattern.match(text)):
-        self.case = key
-        break
-    for (key, pattern) in Casing.match_separators.items():
-      if (pattern.match(text)):
-        self.separator = key
-        break
-    return(self)
-  
-  # split a string in this casing convention into words
-  def split(self, text):
-    # remove prefixes and suffixes
-    m = Casing.match_surround.match(text)
-    if (m):
-      prefix = m.group(1)
-      text = m.group(2)
-      suffix = m.group(3)
-    # split by simple separators
-    if (self.separator == '_'):
-      return(tuple(text.split('_')))
-    elif (self.separator == '-'):
-      return(tuple(text.split('-')))
-    elif (self.separator == ''):
-      # for camelCase, insert artificial separators on case boundaries 
-      #  so we can do a simple split
-      text = re.sub(r'([a-z])([A-Z])', r'\1,\2', text)
-      text = re.sub(r'([A-Z])([A-Z][a-z])', r'\1,\2', text)
-      return(tuple(text.lower().split(',')))
+# this class manages a GtkTextTag like MarkTag, but keeps its positions in an
+#  OffsetIndex shared with other tags instead of using GtkTextMarks, which 
+#  the buffer would have to update on every change
+class OffsetTag(MarkTag):
+
+  # the name of the mark used to scroll to a tag
+  scroll_mark_name = 'multicursor_scroll'
+
+  def __init__(self, view, offsets, name, start_iter, end_iter, decorate=True):
+    self.view = view
+    self.doc = self.view.get_buffer()
+    self.name = name
+    self.decorate = decorate
+    self.offsets = offsets
+    self.start_key = offsets.add(start_iter.get_offset(), True, self)
+    self.end_key = offsets.add(end_iter.get_offset(), False, self)
+    # update the tag for its initial position
+    self.do_move_marks()
+
+  def get_start_iter(self):
+    return(self.doc.get_iter_at_offset(self.offsets.get(self.start_key)))
+
+  def get_end_iter(self):
+    return(self.doc.get_iter_at_offset(self.offsets.get(self.end_key)))
+
+  def get_length(self):
+    return(self.offsets.get(self.end_key) - self.offsets.get(self.start_key))
+
+  # update the offsets and the tag to reflect the new locations
+  def do_move_marks(self, new_start_iter=None, new_end_iter=None):
+    self.remove_tag()
+    old_start = self.offsets.get(self.start_key)
+    start = old_start
+    end = self.offsets.get(self.end_key)
+    if (new_start_iter is not None):
+      start = new_start_iter.get_offset()
+    if (new_end_iter is not None):
+      end = new_end_iter.get_offset()
+    # move the leading end first so the offsets can usually stay in order
+    if (start > old_start):
+      self.offsets.set(self.end_key, end)
+      self.offsets.set(self.start_key, start)
     else:
-      return((text,))
-      
-  # assemble a list of words using this casing convention
-  def join(self, words):
-    if (self.case == 'case'):
-      words = map(lambda s: s.lower(), words)
-    elif (self.case == 'CASE'):
-      words = map(lambda s: s.upper(), words)
-    elif (self.case == 'Case'):
-      words = map(lambda s: s.capitalize(), words)
-    if ((self.separator == '') and (self.case == 'case')):
-      words = list(words)
-      words[1:] = map(lambda s: s.capitalize(), words[1:])
-    if (self.separator is not None):
-      inner = self.separator.join(words)
+      self.offsets.set(self.start_key, start)
+      self.offsets.set(self.end_key, end)
+    if (start != end):
+      self.add_tag()
+
+  def set_capturing_gravity(self, capture):
+    self.offsets.set_left_gravity(self.start_key, capture)
+
+  # scroll to the end of the tag using a single shared mark
+  def scroll_onscreen(self):
+    end_iter = self.get_end_iter()
+    mark = self.doc.get_mark(OffsetTag.scroll_mark_name)
+    if (mark is None):
+      mark = self.doc.create_mark(OffsetTag.scroll_mark_name, end_iter, False)
     else:
-      inner = ''.join(words)
-    return(self.prefix+inner+self.suffix)
+      self.doc.move_mark(mark, end_iter)
+    self.view.scroll_mark_onscreen(mark)
+
+  # remove the tag and offsets from the document
+  def remove(self):
+    self.remove_tag()
+    self.offsets.remove(self.start_key)
+    self.offsets.remove(self.end_key)
+
+  # stop tracking offsets without removing the tag
+  def detach(self):
+    self.offsets.remove(self.start_key)
+    self.offsets.remove(self.end_key)
+    return([ ])
@@ -0,0 +1,124 @@
+import re
+from collections import OrderedDict
+
+# this class handles detection and conversion between different casing conventions
+class Casing:
+  
+  # regexes
+  match_surround = re.compile(r'^([_-]*)(.*?)([_-]*)$')
+  match_cases = OrderedDict([
+    # to be lower case, either there must be at least one lower case character and no 
+    #  upper case ones or it must be in camelCase beginning with a lower case character
+    ('case', re.compile(r'^([a-z0-9_-]*[a-z]+[a-z0-9_-]*|[a-z][A-Za-z0-9]*)$')),
+    # to be upper case, there must be at least one upper case character and no lower case ones
+    ('CASE', re.compile(r'^[A-Z0-9_-]*[A-Z]+[A-Z0-9_-]*$')),
+    # to be title case, there must be at least one upper+lower combo or it must be CamelCase
+    #  beginning with an upper case character
+    ('Case', re.compile(r'^([\w-]*[A-Z][a-z][\w-]*|[A-Z][a-z][A-Za-z0-9]*)$'))
+  ])
+  match_separators = OrderedDict([
+    # this one handles single words in one case, where we can't know what the separator might be
+    (None, re.compile(r'^([A-Z0-9]+|[a-z0-9]+|[A-Z][a-z][a-z0-9]*)$')),
+    # this handles camelCase, treated as an empty separator
+    ('', re.compile(r'^[A-Za-z0-9]+$')),
+    # this handles the usual kind of word separators
+    ('_', re.compile(r'^[\w]+$')),
+    ('-', re.compile(r'^[A-Za-z0-9-]+$'))
+  ])
+  
+  def __init__(self, case=None, separator=None, prefix='', suffix=''):
+    # the case used for words in the string ('case', 'CASE', or 'Case')
+    self.case = case
+    # the separator used between words in the string, 
+    #  ('' for camelCase or CamelCase, '_' for snake_case or CONSTANT_CASE, 
+    #   and '-' for things like css-classes)
+    self.separator = separator
+    # optional strings at the beginning or end of the string
+    self.prefix = prefix
+    self.suffix = suffix
+    
+  # return whether the detected casing looks like a keyword
+  def is_keyword(self):
+    return((self.case is not None) or (self.separator is not None))
+
+  # return whether another casing uses the same convention as this one
+  def same_as(self, other):
+    return((self.case == other.case) and 
+           (self.separator == other.separator) and
+           (self.prefix == other.prefix) and
+           (self.suffix == other.suffix))
+
+  # get the strings that will match every casing variant of the given text 
+  #  when searched for without case sensitivity
+  def alternatives(self, text):
+    if ((self.case is None) or (self.separator is None)):
+      return((text,))
+    words = self.split(text)
+    return((Casing('lower', '_').join(words),
+            Casing('lower', '-').join(words),
+            Casing('lower', '').join(words)))
+
+  # get a regular expression source string matching any of the alternatives 
+  #  for the given text, to be compiled without case sensitivity
+  def pattern(self, text):
+    return('|'.join(map(re.escape, self.alternatives(text))))
+  
+  # detect the casing convention for the given string and return an instance
+  #  with all properties set to the detected values or None if the text was
+  #  indeterminate in some way (e.g. you can't detect a separator from a single word)
+  def detect(self, text):
+    # remove prefixes and suffixes
+    m = Casing.match_surround.match(text)
+    if (m):
+      self.prefix = m.group(1)
+      text = m.group(2)
+      self.suffix = m.group(3)
+    # detect case and separator
+    for (key, pattern) in Casing.match_cases.items():
+      if (pattern.match(text)):
+        self.case = key
+        break
+    for (key, pattern) in Casing.match_separators.items():
+      if (pattern.match(text)):
+        self.separator = key
+        break
+    return(self)
+  
+  # split a string in this casing convention into words
+  def split(self, text):
+    # remove prefixes and suffixes
+    m = Casing.match_surround.match(text)
+    if (m):
+      prefix = m.group(1)
+      text = m.group(2)
+      suffix = m.group(3)
+    # split by simple separators
+    if (self.separator == '_'):
+      return(tuple(text.split('_')))
+    elif (self.separator == '-'):
+      return(tuple(text.split('-')))
+    elif (self.separator == ''):
+      # for camelCase, insert artificial separators on case boundaries 
+      #  so we can do a simple split
+      text = re.sub(r'([a-z])([A-Z])', r'\1,\2', text)
+      text = re.sub(r'([A-Z])([A-Z][a-z])', r'\1,\2', text)
+      return(tuple(text.lower().split(',')))
+    else:
+      return((text,))
+      
+  # assemble a list of words using this casing convention
+  def join(self, words):
+    if (self.case == 'case'):
+      words = map(lambda s: s.lower(), words)
+    elif (self.case == 'CASE'):
+      words = map(lambda s: s.upper(), words)
+    elif (self.case == 'Case'):
+      words = map(lambda s: s.capitalize(), words)
+    if ((self.separator == '') and (self.case == 'case')):
+      words = list(words)
+      words[1:] = map(lambda s: s.capitalize(), words[1:])
+    if (self.separator is not None):
+      inner = self.separator.join(words)
+    else:
+      inner = ''.join(words)
+    return(self.prefix+inner+self.suffix)
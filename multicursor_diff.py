@@ -0,0 +1,132 @@
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+# this class maps offsets in one version of a text to offsets in another
+#  by matching up the lines the two versions have in common
+#
+# Lines are matched with a patience diff: lines that occur exactly once in
+#  both versions anchor the match, and the regions between anchors are
+#  matched the same way, so the cost stays close to linear in the number of
+#  lines. Regions with no unique lines in common are treated as changed
+#  rather than searched exhaustively. Offsets inside lines that changed have
+#  nowhere to go and map to None.
+class OffsetMap:
+
+  def __init__(self, old_text, new_text):
+    old_lines = old_text.splitlines(True)
+    new_lines = new_text.splitlines(True)
+    # get the offset where each line starts, plus the length of the text
+    old_starts = [ 0 ] + list(accumulate(len(line) for line in old_lines))
+    new_starts = [ 0 ] + list(accumulate(len(line) for line in new_lines))
+    self._length = len(new_text)
+    # compare lines by number, with a missing newline at the end of the
+    #  text matching one that's there, so a cursor at the end survives a
+    #  newline being added or removed there
+    ids = dict()
+    old_ids = self._line_ids(old_lines, ids)
+    new_ids = self._line_ids(new_lines, ids)
+    # convert matched lines into unchanged blocks in character offsets,
+    #  keeping the start of each block in the old text, where it ends,
+    #  and how far it moves
+    self._starts = [ ]
+    self._ends = [ ]
+    self._shifts = [ ]
+    for (a, b, size) in self._match_blocks(old_ids, new_ids):
+      self._starts.append(old_starts[a])
+      self._ends.append(old_starts[a + size])
+      self._shifts.append(new_starts[b] - old_starts[a])
+
+  # get the offset in the new text for the given offset in the old text,
+  #  or None if it was in a line that changed
+  def get(self, offset):
+    i = bisect_right(self._ends, offset)
+    if ((i < len(self._starts)) and (self._starts[i] <= offset)):
+      return(min(offset + self._shifts[i], self._length))
+    # an offset at the end of a block can still be mapped with it
+    if ((i > 0) and (self._ends[i - 1] == offset)):
+      return(min(offset + self._shifts[i - 1], self._length))
+    return(None)
+
+  # get a number for each line, using the same number for equal lines
+  def _line_ids(self, lines, ids):
+    result = [ ids.setdefault(line, len(ids)) for line in lines ]
+    if ((len(lines) > 0) and (not lines[-1].endswith(('\n', '\r')))):
+      result[-1] = ids.setdefault(lines[-1] + '\n', len(ids))
+    return(result)
+
+  # get (old line, new line, line count) blocks of matching lines in order
+  def _match_blocks(self, a, b):
+    pairs = [ ]
+    regions = [ (0, len(a), 0, len(b)) ]
+    while (len(regions) > 0):
+      (a_lo, a_hi, b_lo, b_hi) = regions.pop()
+      # match up lines at the start and end of the region directly
+      while ((a_lo < a_hi) and (b_lo < b_hi) and (a[a_lo] == b[b_lo])):
+        pairs.append((a_lo, b_lo))
+        a_lo += 1
+        b_lo += 1
+      while ((a_lo < a_hi) and (b_lo < b_hi) and
+             (a[a_hi - 1] == b[b_hi - 1])):
+        a_hi -= 1
+        b_hi -= 1
+        pairs.append((a_hi, b_hi))
+      if ((a_lo == a_hi) or (b_lo == b_hi)):
+        continue
+      # match the rest around the lines that are unique on both sides
+      anchors = self._unique_anchors(a, a_lo, a_hi, b, b_lo, b_hi)
+      if (len(anchors) == 0):
+        continue
+      for (i, j) in anchors:
+        pairs.append((i, j))
+        regions.append((a_lo, i, b_lo, j))
+        (a_lo, b_lo) = (i + 1, j + 1)
+      regions.append((a_lo, a_hi, b_lo, b_hi))
+    pairs.sort()
+    # join runs of consecutive pairs into blocks
+    blocks = [ ]
+    for (i, j) in pairs:
+      if ((len(blocks) > 0) and (blocks[-1][0] + blocks[-1][2] == i) and
+          (blocks[-1][1] + blocks[-1][2] == j)):
+        (start_a, start_b, size) = blocks[-1]
+        blocks[-1] = (start_a, start_b, size + 1)
+      else:
+        blocks.append((i, j, 1))
+    return(blocks)
+
+  # get the longest in-order sequence of (old line, new line) pairs for
+  #  lines that occur exactly once in both regions
+  def _unique_anchors(self, a, a_lo, a_hi, b, b_lo, b_hi):
+    counts = dict()
+    for i in range(a_lo, a_hi):
+      entry = counts.get(a[i])
+      counts[a[i]] = ([ 1, i, 0, None ] if (entry is None) else
+                      [ entry[0] + 1, i, 0, None ])
+    for j in range(b_lo, b_hi):
+      entry = counts.get(b[j])
+      if (entry is not None):
+        entry[2] += 1
+        entry[3] = j
+    pairs = sorted((i, j) for (count_a, i, count_b, j) in counts.values()
+                   if ((count_a == 1) and (count_b == 1)))
+    # patience sort on the new line numbers to find the longest increasing
+    #  run, remembering each pair's predecessor to walk it back
+    tails = [ ]
+    tail_indexes = [ ]
+    previous = [ None ] * len(pairs)
+    for (k, (i, j)) in enumerate(pairs):
+      pile = bisect_left(tails, j)
+      if (pile > 0):
+        previous[k] = tail_indexes[pile - 1]
+      if (pile == len(tails)):
+        tails.append(j)
+        tail_indexes.append(k)
+      else:
+        tails[pile] = j
+        tail_indexes[pile] = k
+    anchors = [ ]
+    k = (tail_indexes[-1] if (len(tail_indexes) > 0) else None)
+    while (k is not None):
+      anchors.append(pairs[k])
+      k = previous[k]
+    anchors.reverse()
+    return(anchors)
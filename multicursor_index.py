@@ -0,0 +1,162 @@
+# this class tracks a set of offsets into a text buffer without using marks,
+#  shifting them like marks when text is inserted or deleted
+#
+# Offsets are kept in sorted order by rank, and each one's value is the sum
+#  of a base value for its rank and a prefix sum in a Fenwick tree, so shifting
+#  every offset after an edit is a single O(log n) tree update. Changes that
+#  could break the order are queued and the whole index is re-sorted once
+#  before it's next needed in order.
+class OffsetIndex:
+
+  def __init__(self):
+    self.clear()
+
+  # remove all offsets
+  def clear(self):
+    # the key at each rank, in order of offset
+    self._keys = [ ]
+    # the rank of each key
+    self._ranks = dict()
+    # the base value at each rank
+    self._base = [ ]
+    # a Fenwick tree of shifts applying to each rank and all after it
+    self._tree = [ ]
+    # the gravity of each live key, True if it stays left of inserted text
+    self._left = dict()
+    # data attached to each key by the caller
+    self._data = dict()
+    # offsets for keys that have been added or moved out of order
+    self._pending = dict()
+    # the number of removed keys still taking up a rank
+    self._removed = 0
+    # the next key to give out
+    self._next_key = 0
+
+  def __len__(self):
+    return(len(self._left))
+
+  # add an offset with the given gravity and optional data to attach,
+  #  returning a key to refer to it by
+  def add(self, offset, left_gravity=False, data=None):
+    key = self._next_key
+    self._next_key += 1
+    self._left[key] = left_gravity
+    self._data[key] = data
+    self._pending[key] = offset
+    return(key)
+
+  # stop tracking the offset for the given key
+  def remove(self, key):
+    del self._left[key]
+    del self._data[key]
+    self._pending.pop(key, None)
+    if (key in self._ranks):
+      self._removed += 1
+
+  # get the current offset for the given key
+  def get(self, key):
+    if (key in self._pending):
+      return(self._pending[key])
+    return(self._value(self._ranks[key]))
+
+  # get the data attached to the given key
+  def get_data(self, key):
+    return(self._data[key])
+
+  # move the offset for the given key
+  def set(self, key, offset):
+    if ((len(self._pending) == 0) and (key in self._ranks)):
+      # move in place if the offset stays in order with its neighbors
+      rank = self._ranks[key]
+      if (((rank == 0) or (self._value(rank - 1) <= offset)) and
+          ((rank + 1 == len(self._keys)) or
+           (offset <= self._value(rank + 1)))):
+        self._base[rank] += offset - self._value(rank)
+        return
+    self._pending[key] = offset
+
+  # set whether the offset for the given key stays left of text inserted there
+  def set_left_gravity(self, key, left_gravity):
+    self._left[key] = left_gravity
+
+  # get the keys with offsets in the given range, in order
+  def keys_between(self, start, end):
+    self._sort()
+    first = self._first_rank(start, True)
+    last = self._first_rank(end, False)
+    return([ key for key in self._keys[first:last] if (key in self._left) ])
+
+  # shift offsets for text of the given length inserted at the given offset
+  def insert(self, offset, length):
+    self._sort()
+    first = self._first_rank(offset, True)
+    last = self._first_rank(offset, False)
+    # offsets right at the insertion point move or stay depending on gravity,
+    #  so put the ones that stay first to keep the order after the shift
+    if (last - first > 1):
+      tied = sorted(self._keys[first:last],
+                    key=lambda k: (not self._left.get(k, True)))
+      for (i, key) in enumerate(tied, first):
+        self._keys[i] = key
+        self._ranks[key] = i
+    moved = first
+    while ((moved < last) and (self._left.get(self._keys[moved], True))):
+      moved += 1
+    self._shift(moved, length)
+
+  # shift offsets for text deleted between the given offsets
+  def delete(self, start, end):
+    self._sort()
+    first = self._first_rank(start, False)
+    last = self._first_rank(end, False)
+    # collapse offsets inside the deleted range onto its start
+    for rank in range(first, last):
+      self._base[rank] += start - self._value(rank)
+    self._shift(last, start - end)
+
+  # get the offset at the given rank
+  def _value(self, rank):
+    total = self._base[rank]
+    i = rank + 1
+    while (i > 0):
+      total += self._tree[i - 1]
+      i -= i & (-i)
+    return(total)
+
+  # shift the offsets at the given rank and all after it
+  def _shift(self, rank, delta):
+    i = rank + 1
+    while (i <= len(self._tree)):
+      self._tree[i - 1] += delta
+      i += i & (-i)
+
+  # get the first rank with an offset after the given one, or at it if
+  #  inclusive is True
+  def _first_rank(self, offset, inclusive):
+    (lo, hi) = (0, len(self._keys))
+    while (lo < hi):
+      mid = (lo + hi) // 2
+      value = self._value(mid)
+      if ((value < offset) or ((not inclusive) and (value == offset))):
+        lo = mid + 1
+      else:
+        hi = mid
+    return(lo)
+
+  # rebuild the index in order if offsets have been added, moved or removed
+  def _sort(self):
+    if ((len(self._pending) == 0) and
+        ((self._removed == 0) or (self._removed * 2 < len(self._keys)))):
+      return
+    entries = [ ]
+    for (rank, key) in enumerate(self._keys):
+      if ((key in self._left) and (key not in self._pending)):
+        entries.append((self._value(rank), key))
+    entries.extend((offset, key) for (key, offset) in self._pending.items())
+    entries.sort(key=lambda e: (e[0], not self._left[e[1]]))
+    self._keys = [ key for (offset, key) in entries ]
+    self._ranks = dict((key, rank) for (rank, key) in enumerate(self._keys))
+    self._base = [ offset for (offset, key) in entries ]
+    self._tree = [ 0 ] * len(entries)
+    self._pending = dict()
+    self._removed = 0
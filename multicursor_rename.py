@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+# rename a keyword in all of its casing conventions across a tree of files,
+#  the same way fuzzy matching (Control-Shift-d) and typing would in gedit
+
+import argparse
+import fnmatch
+import os
+import re
+import sys
+from concurrent.futures import (ProcessPoolExecutor, FIRST_COMPLETED,
+                                as_completed, wait)
+from functools import lru_cache
+
+from multicursor_casing import Casing
+
+# this class rewrites every casing variant of a keyword in some text
+class Renamer:
+
+  def __init__(self, search, replacement, whole_words=True):
+    self.search = search
+    self.replacement = replacement
+    # the casing of the search text decides which matches need conversion,
+    #  like the casing of the main selection does for fuzzy cursors
+    self.casing = Casing().detect(search)
+    replacement_casing = Casing().detect(replacement)
+    self.words = replacement_casing.split(replacement)
+    self.track_casing = replacement_casing.is_keyword()
+    pattern = self.casing.pattern(search)
+    # unlike the interactive search, don't match inside longer words by default,
+    #  since nobody is looking at each match before it gets replaced, but do
+    #  take in leading and trailing separators, which keep their place
+    if (whole_words):
+      pattern = r'(?<![\w-])[_-]*(?:%s)[_-]*(?![\w-])' % pattern
+    self.regex = re.compile(pattern, re.IGNORECASE)
+
+  # get the replacement for a single match
+  def replace(self, m):
+    text = m.group(0)
+    if (not self.track_casing):
+      return(self.replacement)
+    match_casing = Casing().detect(text)
+    if (match_casing.same_as(self.casing)):
+      return(self.replacement)
+    return(match_casing.join(self.words))
+
+  # rename all matches in the given text, returning the new text and
+  #  the number of matches replaced
+  def rename(self, text):
+    return(self.regex.subn(self.replace, text))
+
+# cache renamers so each worker process compiles the expression once
+@lru_cache(maxsize=None)
+def get_renamer(search, replacement, whole_words):
+  return(Renamer(search, replacement, whole_words))
+
+# rename in a single file, returning a tuple of the path, the number of
+#  matches replaced, and an error message or None
+def rename_file(path, search, replacement, whole_words=True, dry_run=False):
+  try:
+    with open(path, 'rb') as f:
+      data = f.read()
+    # skip anything that doesn't look like text
+    if (b'\0' in data[:8192]):
+      return((path, 0, None))
+    text = data.decode('utf-8')
+  except UnicodeDecodeError:
+    return((path, 0, None))
+  except OSError as e:
+    return((path, 0, str(e)))
+  (text, count) = get_renamer(search, replacement, whole_words).rename(text)
+  if ((count > 0) and (not dry_run)):
+    try:
+      with open(path, 'wb') as f:
+        f.write(text.encode('utf-8'))
+    except OSError as e:
+      return((path, 0, str(e)))
+  return((path, count, None))
+
+# list the files under the given paths, skipping hidden directories and
+#  keeping only files whose names match one of the include patterns
+def find_files(paths, include=None):
+  for root in paths:
+    if (os.path.isfile(root)):
+      yield root
+      continue
+    for (dirpath, dirnames, filenames) in os.walk(root):
+      dirnames[:] = sorted(d for d in dirnames if (not d.startswith('.')))
+      for name in sorted(filenames):
+        if ((include) and
+            (not any(fnmatch.fnmatch(name, p) for p in include))):
+          continue
+        yield os.path.join(dirpath, name)
+
+# rename across all files under the given paths using a pool of processes,
+#  yielding the result for each file as soon as it finishes, with no more 
+#  than backlog files submitted per worker at a time
+def rename_tree(paths, search, replacement, include=None, whole_words=True,
+                dry_run=False, jobs=None, backlog=8):
+  workers = (jobs or os.cpu_count() or 1)
+  limit = workers * backlog
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    pending = set()
+    for path in find_files(paths, include):
+      pending.add(executor.submit(rename_file, path, search, replacement,
+                                  whole_words, dry_run))
+      if (len(pending) >= limit):
+        (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+          yield future.result()
+    for future in as_completed(pending):
+      yield future.result()
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description='Rename a keyword in all of its casing conventions, so that '
+                'renaming my_thing to other_thing also turns MY_THING into '
+                'OTHER_THING and myThing into otherThing.')
+  parser.add_argument('search', help='the keyword to rename')
+  parser.add_argument('replacement', help='the new name')
+  parser.add_argument('paths', nargs='*', default=['.'],
+                      help='files or directories to rename in')
+  parser.add_argument('-i', '--include', action='append', metavar='GLOB',
+                      help='only rename in files matching this pattern')
+  parser.add_argument('-p', '--partial', action='store_true',
+                      help='also rename inside longer words')
+  parser.add_argument('-n', '--dry-run', action='store_true',
+                      help="report matches but don't change any files")
+  parser.add_argument('-j', '--jobs', type=int, default=None,
+                      help='the number of worker processes to use')
+  args = parser.parse_args(argv)
+  files = 0
+  total = 0
+  errors = 0
+  for (path, count, error) in rename_tree(
+      args.paths, args.search, args.replacement, include=args.include,
+      whole_words=(not args.partial), dry_run=args.dry_run, jobs=args.jobs):
+    if (error is not None):
+      errors += 1
+      print('%s: %s' % (path, error), file=sys.stderr)
+    elif (count > 0):
+      files += 1
+      total += count
+      print('%s: %d' % (path, count), flush=True)
+  print('%d matches in %d files' % (total, files), file=sys.stderr)
+  return(1 if (errors > 0) else 0)
+
+if (__name__ == '__main__'):
+  sys.exit(main())
@@ -0,0 +1,17 @@
+#!/bin/bash
+
+# run the plugin through random edits in a headless gedit, failing on leaks,
+#  using a throwaway profile so the soak plugin never reaches the real one
+python -m py_compile multicursor*.py soak/multicursor_soak.py || exit 1
+profile=$(mktemp -d)
+trap 'rm -rf "$profile"' EXIT
+export XDG_DATA_HOME="$profile/data" XDG_CONFIG_HOME="$profile/config"
+export GSETTINGS_BACKEND=keyfile
+plugins="$XDG_DATA_HOME/gedit/plugins"
+mkdir -p "$plugins"
+cp multicursor.plugin multicursor*.py soak/multicursor_soak.* "$plugins/"
+gsettings set org.gnome.gedit.plugins active-plugins \
+  "['multicursor', 'multicursor_soak']"
+output=$(MULTICURSOR_SOAK_ROUNDS=${1:-200} xvfb-run -a gedit --standalone test.txt)
+echo "$output"
+! echo "$output" | grep -q '^LEAK'
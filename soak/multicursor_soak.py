@@ -0,0 +1,231 @@
+from gi.repository import GObject, GLib, Gio, Gedit
+
+import os
+import random
+import re
+import time
+import tracemalloc
+
+from multicursor import MultiCursor
+
+# this plugin is only installed by soak.sh, and starts a soak test on the 
+#  first view's MultiCursor plugin once it's active
+class MultiCursorSoak(GObject.Object, Gedit.ViewActivatable):
+  __gtype_name__ = "MultiCursorSoak"
+  view = GObject.property(type=Gedit.View)
+
+  def __init__(self):
+    GObject.Object.__init__(self)
+
+  # wait for the MultiCursor plugin, which may be activated after us
+  def do_activate(self):
+    GLib.idle_add(self.start)
+  def do_deactivate(self):
+    pass
+
+  def start(self):
+    plugin = MultiCursor.for_view(self.view)
+    if (plugin is None):
+      return(True)
+    rounds = int(os.environ.get('MULTICURSOR_SOAK_ROUNDS', '500'))
+    Soak(plugin, rounds).start()
+    return(False)
+
+
+# this class drives a MultiCursor plugin through random rounds of editing,
+#  checking after each round that everything it created has been cleaned up
+class Soak:
+
+  # whether a soak test has been started in this process
+  started = False
+
+  # tags the plugin can leave in the document
+  tag_names = ('multicursor', 'multicursor_match')
+
+  def __init__(self, plugin, rounds, ops_per_round=25, seed=None):
+    self.plugin = plugin
+    self.view = plugin.view
+    self.doc = plugin.doc
+    self.rounds = rounds
+    self.ops_per_round = ops_per_round
+    self.random = random.Random(seed)
+    self.round = 0
+    self.leaks = 0
+    # the weighted operations to choose from each step
+    self.ops = (
+      (self.op_match, 4),
+      (self.op_column, 2),
+      (self.op_type, 4),
+      (self.op_delete, 2),
+      (self.op_undo, 2),
+      (self.op_redo, 1),
+      (self.op_escape, 1)
+    )
+    # samples taken after each round, for computing growth rates
+    self.memory = [ ]
+    self.history = [ ]
+    # the highest undo level the plugin has reached since the last reset
+    self.peak_level = 0
+    self.op_times = dict()
+
+  # start running rounds when gedit is idle
+  def start(self):
+    if (Soak.started): return
+    Soak.started = True
+    tracemalloc.start()
+    self.text = self.doc.get_text(
+      self.doc.get_start_iter(), self.doc.get_end_iter(), True)
+    self.baseline = self.measure()
+    print('soak: %d rounds of %d operations, baseline %r' %
+          (self.rounds, self.ops_per_round, self.baseline), flush=True)
+    GLib.idle_add(self.step)
+
+  # run one round, returning whether there are more to run
+  def step(self):
+    for i in range(self.ops_per_round):
+      (op, ) = self.random.choices(
+        [ op for (op, weight) in self.ops ],
+        [ weight for (op, weight) in self.ops ])
+      started = time.perf_counter()
+      op()
+      elapsed = time.perf_counter() - started
+      self.op_times.setdefault(op.__name__, [ ]).append((self.round, elapsed))
+      self.peak_level = max(self.peak_level, self.plugin.undo_level)
+    # undo states go away with their cursors, so check them before the reset
+    self.check_history()
+    self.reset()
+    self.check()
+    self.memory.append(tracemalloc.get_traced_memory()[0])
+    self.round += 1
+    if (self.round < self.rounds):
+      return(True)
+    self.report()
+    Gio.Application.get_default().quit()
+    return(False)
+
+  # clear all cursors and put the document back the way it started
+  def reset(self):
+    self.plugin.clear_cursors()
+    # don't wait for idle to delete the marks of cleared cursors
+    self.plugin.delete_dead_marks()
+    self.doc.begin_not_undoable_action()
+    self.doc.set_text(self.text)
+    self.doc.end_not_undoable_action()
+    self.doc.place_cursor(self.doc.get_start_iter())
+    self.peak_level = 0
+
+  # get counts of everything the plugin can leak
+  def measure(self):
+    marks = 0
+    pos = self.doc.get_start_iter()
+    while (True):
+      marks += len(pos.get_marks())
+      if (pos.is_end()): break
+      pos.forward_char()
+    tag_ranges = 0
+    table = self.doc.get_tag_table()
+    for name in Soak.tag_names:
+      tag = table.lookup(name)
+      if (tag is None): continue
+      pos = self.doc.get_start_iter()
+      toggles = (1 if pos.toggles_tag(tag) else 0)
+      while (pos.forward_to_tag_toggle(tag)):
+        toggles += 1
+      tag_ranges += toggles // 2
+    return({
+      'marks': marks,
+      'tag_ranges': tag_ranges,
+      'cursors': len(self.plugin.cursors),
+      'search': (self.plugin.search.text is not None),
+      'edits': len(self.plugin._edits),
+      'handlers': len(self.plugin._handlers),
+      'tracker': (self.plugin.tracker is not None)
+    })
+
+  # make sure everything is back to the baseline
+  def check(self):
+    counts = self.measure()
+    for (key, value) in counts.items():
+      if (value != self.baseline[key]):
+        self.leaks += 1
+        print('LEAK round %d: %s is %r, expected %r' %
+              (self.round, key, value, self.baseline[key]), flush=True)
+
+  # make sure no cursor keeps more undo states than there are levels it 
+  #  could have been at, and record how many states the cursors hold
+  def check_history(self):
+    total = 0
+    for cursor in self.plugin.cursors:
+      total += len(cursor.state)
+      limit = self.peak_level - cursor.initial_state_index + 1
+      if (len(cursor.state) > limit):
+        self.leaks += 1
+        print('LEAK round %d: a cursor has %d undo states, expected at most %d' %
+              (self.round, len(cursor.state), limit), flush=True)
+    self.history.append(total)
+
+  # print growth rates of memory and time per operation
+  def report(self):
+    print('soak: memory %+.1f bytes/round (%d bytes after %d rounds)' %
+          (self.slope(list(enumerate(self.memory))), self.memory[-1],
+           self.rounds), flush=True)
+    print('soak: undo history %+.2f states/round (%d states in the last round)' %
+          (self.slope(list(enumerate(self.history))), self.history[-1]),
+          flush=True)
+    for (name, samples) in sorted(self.op_times.items()):
+      mean = (sum(t for (r, t) in samples) / len(samples))
+      print('soak: %s %d calls, %.3f ms/call, %+.4f ms/call/round' %
+            (name, len(samples), mean * 1000, self.slope(samples) * 1000),
+            flush=True)
+    print('soak: %d leaks' % self.leaks, flush=True)
+
+  # get the least-squares slope of a list of (x, y) samples
+  def slope(self, samples):
+    n = len(samples)
+    if (n < 2): return(0.0)
+    mean_x = sum(x for (x, y) in samples) / n
+    mean_y = sum(y for (x, y) in samples) / n
+    var = sum((x - mean_x) ** 2 for (x, y) in samples)
+    if (var == 0): return(0.0)
+    return(sum((x - mean_x) * (y - mean_y) for (x, y) in samples) / var)
+
+  # select a random word and add a cursor at its next match like Control-d
+  def op_match(self):
+    if (len(self.plugin.cursors) == 0):
+      text = self.doc.get_slice(
+        self.doc.get_start_iter(), self.doc.get_end_iter(), True)
+      words = list(re.finditer(r'\w+', text))
+      if (len(words) == 0): return
+      word = self.random.choice(words)
+      self.doc.select_range(self.doc.get_iter_at_offset(word.end()),
+                            self.doc.get_iter_at_offset(word.start()))
+    self.plugin.match_cursor(fuzzy=(self.random.random() < 0.5))
+
+  # extend a column of cursors like Control-Up and Control-Down
+  def op_column(self):
+    self.plugin.column_select(self.random.choice((-1, 1)))
+
+  # type some text at the main cursor
+  def op_type(self):
+    text = self.random.choice(('a', 'Z', '_', ' ', 'xy', '\n', '\t'))
+    self.doc.begin_user_action()
+    self.doc.insert_interactive_at_cursor(text, -1, True)
+    self.doc.end_user_action()
+
+  # backspace at the main cursor
+  def op_delete(self):
+    pos = self.doc.get_iter_at_mark(self.doc.get_insert())
+    self.doc.begin_user_action()
+    self.doc.backspace(pos, True, True)
+    self.doc.end_user_action()
+
+  def op_undo(self):
+    if (self.doc.get_undo_manager().can_undo()):
+      self.view.emit('undo')
+
+  def op_redo(self):
+    if (self.doc.get_undo_manager().can_redo()):
+      self.view.emit('redo')
+
+  def op_escape(self):
+    self.plugin.clear_cursors()
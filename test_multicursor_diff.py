@@ -0,0 +1,69 @@
+import random
+import time
+
+from multicursor_diff import OffsetMap
+
+def test_unchanged_text_maps_every_offset():
+  text = 'one\ntwo\nthree\n'
+  offset_map = OffsetMap(text, text)
+  assert [ offset_map.get(i) for i in range(len(text) + 1) ] == (
+    list(range(len(text) + 1)))
+
+def test_inserted_line_shifts_later_lines():
+  offset_map = OffsetMap('a\nb\nc\n', 'a\nX\nb\nc\n')
+  assert [ offset_map.get(i) for i in range(7) ] == [ 0, 1, 4, 5, 6, 7, 8 ]
+
+def test_removed_line_drops_its_offsets():
+  offset_map = OffsetMap('a\nb\nc\n', 'a\nc\n')
+  # the start of the removed line is still the end of the line before it
+  assert offset_map.get(2) == 2
+  assert offset_map.get(3) is None
+  assert offset_map.get(4) == 2
+
+def test_changed_line_between_unchanged_ones():
+  offset_map = OffsetMap('x = 1\ny = 2\nz = 3\n', 'x = 1\ny = 20\nz = 3\n')
+  assert offset_map.get(2) == 2
+  assert offset_map.get(8) is None
+  assert offset_map.get(12) == 13
+
+def test_end_survives_a_final_newline_being_added_or_removed():
+  assert OffsetMap('a\nb', 'a\nb\n').get(3) == 3
+  assert OffsetMap('a\nb\n', 'a\nb').get(4) == 3
+
+# a mapped offset must stay in order and land inside the same line content
+def test_random_edits_map_into_identical_lines():
+  rng = random.Random(1)
+  for trial in range(2000):
+    old = [ rng.choice('abcdef') for i in range(rng.randint(1, 15)) ]
+    new = list(old)
+    for k in range(rng.randint(0, 3)):
+      if ((rng.random() < 0.5) and (len(new) > 0)):
+        del new[rng.randrange(len(new))]
+      else:
+        new.insert(rng.randint(0, len(new)), rng.choice('abcxyz'))
+    old_text = ''.join(line + '\n' for line in old)
+    new_text = ''.join(line + '\n' for line in new)
+    offset_map = OffsetMap(old_text, new_text)
+    previous = -1
+    for offset in range(len(old_text)):
+      mapped = offset_map.get(offset)
+      if (mapped is None): continue
+      assert mapped >= previous
+      previous = mapped
+      # a line start can map to the end of the line before it
+      if ((offset > 0) and (old_text[offset - 1] != '\n')):
+        assert new_text[mapped] == old_text[offset]
+
+# a formatter touching every other line of a big file shouldn't stall a reload
+def test_large_reformat_is_fast():
+  old_lines = [ 'line_%d = compute(%d)\n' % (i, i) for i in range(30000) ]
+  new_lines = [ (('  ' + line) if (i % 2 == 0) else line)
+                for (i, line) in enumerate(old_lines) ]
+  old_text = ''.join(old_lines)
+  new_text = ''.join(new_lines)
+  started = time.perf_counter()
+  offset_map = OffsetMap(old_text, new_text)
+  assert time.perf_counter() - started < 2.0
+  offset = len(old_lines[0]) + 5
+  assert offset_map.get(offset) == len(new_lines[0]) + 5
+  assert offset_map.get(5) is None
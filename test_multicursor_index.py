@@ -0,0 +1,77 @@
+import random
+
+from multicursor_index import OffsetIndex
+
+# this class tracks offsets in a plain dict, shifting each one on every edit
+class NaiveIndex:
+
+  def __init__(self):
+    self.offsets = dict()
+    self.left = dict()
+
+  def insert(self, offset, length):
+    for (key, value) in self.offsets.items():
+      if ((value > offset) or ((value == offset) and (not self.left[key]))):
+        self.offsets[key] = value + length
+
+  def delete(self, start, end):
+    for (key, value) in self.offsets.items():
+      if (value >= end):
+        self.offsets[key] = value - (end - start)
+      elif (value > start):
+        self.offsets[key] = start
+
+  def keys_between(self, start, end):
+    return(sorted(key for (key, value) in self.offsets.items()
+                  if (start <= value <= end)))
+
+def test_matches_naive_model():
+  for seed in range(100):
+    rng = random.Random(seed)
+    index = OffsetIndex()
+    naive = NaiveIndex()
+    length = 100
+    for step in range(300):
+      op = rng.random()
+      keys = list(naive.offsets)
+      if ((op < 0.25) or (len(keys) == 0)):
+        (offset, left) = (rng.randint(0, length), (rng.random() < 0.5))
+        key = index.add(offset, left, data=offset)
+        naive.offsets[key] = offset
+        naive.left[key] = left
+        assert index.get_data(key) == offset
+      elif (op < 0.35):
+        key = rng.choice(keys)
+        index.remove(key)
+        del naive.offsets[key]
+      elif (op < 0.5):
+        (key, offset) = (rng.choice(keys), rng.randint(0, length))
+        index.set(key, offset)
+        naive.offsets[key] = offset
+      elif (op < 0.55):
+        key = rng.choice(keys)
+        left = (rng.random() < 0.5)
+        index.set_left_gravity(key, left)
+        naive.left[key] = left
+      elif (op < 0.75):
+        (offset, size) = (rng.randint(0, length), rng.randint(1, 10))
+        index.insert(offset, size)
+        naive.insert(offset, size)
+        length += size
+      elif (op < 0.95):
+        start = rng.randint(0, length)
+        end = min(length, start + rng.randint(1, 10))
+        index.delete(start, end)
+        naive.delete(start, end)
+        length -= (end - start)
+      else:
+        start = rng.randint(0, length)
+        end = rng.randint(start, length)
+        keys = index.keys_between(start, end)
+        assert sorted(keys) == naive.keys_between(start, end)
+        # keys come back in order of offset
+        values = [ naive.offsets[key] for key in keys ]
+        assert values == sorted(values)
+      assert len(index) == len(naive.offsets)
+      for (key, value) in naive.offsets.items():
+        assert index.get(key) == value
@@ -0,0 +1,48 @@
+import os
+
+from multicursor_rename import Renamer, rename_tree
+
+# whole-word renames shouldn't reach inside longer identifiers
+def test_whole_words_skip_longer_identifiers():
+  renamer = Renamer('my_variable', 'new_name')
+  assert renamer.rename('is_my_variable_x') == ('is_my_variable_x', 0)
+  assert renamer.rename('get-my-variable') == ('get-my-variable', 0)
+  assert Renamer('user', 'account').rename('get_user') == ('get_user', 0)
+
+# leading and trailing separators stay where they are
+def test_whole_words_keep_separators():
+  renamer = Renamer('my_variable', 'new_name')
+  assert renamer.rename('_my_variable') == ('_new_name', 1)
+  assert renamer.rename('__MY_VARIABLE__') == ('__NEW_NAME__', 1)
+  assert renamer.rename('x = myVariable;') == ('x = newName;', 1)
+
+def test_partial_renames_inside_words():
+  renamer = Renamer('my_variable', 'new_name', whole_words=False)
+  assert renamer.rename('is_my_variable_x') == ('is_new_name_x', 1)
+
+def test_rename_tree_reports_every_file(tmp_path):
+  (tmp_path / 'a.py').write_text('my_variable = MY_VARIABLE\n')
+  (tmp_path / 'sub').mkdir()
+  (tmp_path / 'sub' / 'b.py').write_text('myVariable()\n')
+  (tmp_path / 'sub' / 'c.txt').write_text('nothing here\n')
+  (tmp_path / '.hidden').mkdir()
+  (tmp_path / '.hidden' / 'd.py').write_text('my_variable\n')
+  results = dict((os.path.relpath(path, str(tmp_path)), (count, error))
+                 for (path, count, error) in rename_tree(
+                   [ str(tmp_path) ], 'my_variable', 'new_name', jobs=2,
+                   backlog=1))
+  assert results == {
+    'a.py': (2, None),
+    os.path.join('sub', 'b.py'): (1, None),
+    os.path.join('sub', 'c.txt'): (0, None)
+  }
+  assert (tmp_path / 'a.py').read_text() == 'new_name = NEW_NAME\n'
+  assert (tmp_path / 'sub' / 'b.py').read_text() == 'newName()\n'
+  assert (tmp_path / '.hidden' / 'd.py').read_text() == 'my_variable\n'
+
+def test_rename_tree_dry_run_changes_nothing(tmp_path):
+  (tmp_path / 'a.py').write_text('my_variable\n')
+  results = list(rename_tree([ str(tmp_path) ], 'my_variable', 'new_name',
+                             include=[ '*.py' ], dry_run=True, jobs=1))
+  assert [ count for (path, count, error) in results ] == [ 1 ]
+  assert (tmp_path / 'a.py').read_text() == 'my_variable\n'